@@ -1,11 +1,16 @@
+import atexit
+import logging
 import os
-import time
 import queue
 
 import pynput
 import pyperclip
 
+import clipboard
+import config
+import context_manager
 import formatter
+import timing
 
 os.system("title LaTeX Hotkey formatter")
 controller = pynput.keyboard.Controller()
@@ -19,45 +24,67 @@ def on_press(key):
 
 
 def process_on_press(key):
-    if str(data) == "<135>":
+    if str(key) == "<135>":
+        start_time = timing.start()
+
+        # A restore which has not happened yet still holds the user's clipboard
+        old_clipboard = clipboard_restorer.take()
+        if old_clipboard is None:
+            old_clipboard = pyperclip.paste()
+
         try:
             highlighted = get_highlighted()
         except pyperclip.PyperclipTimeoutException:
             print("Could not copy to clipboard")
+            clipboard_restorer.schedule(old_clipboard)
             return
 
-        new_str = formatter.reformat(highlighted)
-        paste_output(new_str)
+        try:
+            new_str = text_formatter.reformat(highlighted, context_manager.get_context())
+            paste_output(new_str)
+        finally:
+            # The clipboard is only restored once, after the target window has had time to paste
+            clipboard_restorer.schedule(old_clipboard)
+            timing.stop("hotkey", start_time)
 
 
+@timing.timed("capture")
 def get_highlighted():
-    old_clipboard = pyperclip.paste()
-    pyperclip.copy("")
+    sequence_number = clipboard.get_sequence_number()
 
     with controller.pressed(pynput.keyboard.Key.ctrl):
         controller.touch("c", True)
 
-    selected = pyperclip.waitForPaste(0.1)
-    pyperclip.copy(old_clipboard)
-    return selected
+    if not clipboard.wait_for_change(sequence_number, copy_timeout):
+        raise pyperclip.PyperclipTimeoutException("Selection was not copied to the clipboard")
 
+    return pyperclip.paste()
 
+
+@timing.timed("paste")
 def paste_output(output):
     if output == "":
         controller.touch(pynput.keyboard.Key.backspace, True)
         return
 
-    old_clipboard = pyperclip.paste()
-
     pyperclip.copy(output)
     with controller.pressed(pynput.keyboard.Key.ctrl):
         controller.touch("v", True)
-        time.sleep(0.05)
-
-    pyperclip.copy(old_clipboard)
 
 
 # ----- Main ----- #
+# Parser messages and show_steps traces are shown in the console
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+context_manager.check_platform()
+context_manager.start_prefetch()
+
+copy_timeout = float(config.config["Misc"]["copy_timeout"])
+clipboard_restorer = clipboard.ClipboardRestorer(float(config.config["Misc"]["clipboard_restore_delay"]))
+
+text_formatter = formatter.Formatter(config.get_path("templates.csv"), config.get_path("history.lhfh"))
+atexit.register(text_formatter.close)
+
 with pynput.keyboard.Listener(on_press=on_press) as listener:
     while True:
         event, data, return_queue = event_queue.get()
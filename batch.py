@@ -0,0 +1,148 @@
+import argparse
+import contextlib
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+import config
+import context_manager
+import formatter
+import latex_parser
+
+_formatter = None
+_context = None
+
+
+def _init_worker(font, tabsize, latex_by_default, verbose, templates_path=None):
+    global _formatter
+    global _context
+
+    if verbose:
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if latex_by_default is not None:
+        config.config["Formatting Controls"]["latex_by_default"] = latex_by_default
+
+    # Workers are never given lines which use templates or history, so only the main process needs to load them
+    _formatter = formatter.Formatter(templates_path)
+    _context = context_manager.get_font_context(font or context_manager.default_entry["font"], tabsize)
+    _ = _context.font_info
+
+    # Warm up the parser so the first lines of each worker are not slower than the rest, without adding to the history
+    latex_parser.parse(r"\frac{a}{b}", _context)
+
+
+def _reformat_line(line):
+    return _formatter.reformat(line, _context)
+
+
+def _read_blocks(file, block_size):
+    block = []
+    for line in file:
+        block.append(line.rstrip("\n"))
+
+        if len(block) == block_size:
+            yield block
+            block = []
+
+    if block:
+        yield block
+
+
+def _write_block(file, lines, outputs):
+    for line, new in zip(lines, outputs):
+        # An empty result replaces the selection with nothing, so the line is dropped
+        if new == "" and line.strip():
+            continue
+        file.write(new + "\n")
+
+
+def _reformat_block(pool, processes, lines, control_pattern):
+    # Lines which use templates or history depend on the lines before them, so they are formatted in order by this
+    # process rather than by the workers
+    local = [control_pattern.search(line) is not None for line in lines]
+    remote_lines = [line for line, is_local in zip(lines, local) if not is_local]
+    remote_outputs = iter(pool.map(_reformat_line, remote_lines, max(1, len(remote_lines) // (processes * 4))))
+
+    # The outputs of the workers are added to the history in order, so that recalled entries are the same as if every
+    # line had been formatted here
+    outputs = []
+    for line, is_local in zip(lines, local):
+        if is_local:
+            outputs.append(_reformat_line(line))
+            continue
+
+        outputs.append(new := next(remote_outputs))
+        if new:
+            _formatter.history.add(line, new)
+
+    return outputs
+
+
+def reformat_file(in_file, out_file, processes, block_size, font=None, tabsize=None, latex_by_default=None,
+                  verbose=False):
+    prefix = re.escape(config.config["Formatting Controls"]["prefix"])
+    control_pattern = re.compile(fr"{prefix}(?:s\[|d\[|l\[|lt|lh\[)|(?<![^\s]){prefix}h(?:\[|(?!\w))")
+
+    init_args = (font, tabsize, latex_by_default, verbose)
+    _init_worker(*init_args, templates_path=config.get_path("templates.csv"))
+
+    pool = multiprocessing.Pool(processes, _init_worker, init_args) if processes > 1 else None
+    num_lines = 0
+    start = time.perf_counter()
+
+    try:
+        for lines in _read_blocks(in_file, block_size):
+            if pool is None:
+                outputs = [_reformat_line(line) for line in lines]
+            else:
+                outputs = _reformat_block(pool, processes, lines, control_pattern)
+
+            _write_block(out_file, lines, outputs)
+            num_lines += len(lines)
+
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    _formatter.close()
+    return num_lines, time.perf_counter() - start
+
+
+# ----- Main ----- #
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reformat a file line by line, as if each line had been highlighted "
+                                                 "and formatted with the hotkey.")
+    parser.add_argument("input", help="file to reformat, or - to read from standard input")
+    parser.add_argument("-o", "--output", default="-", help="file to write to, or - for standard output")
+    parser.add_argument("-j", "--processes", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes. 1 formats every line in this process")
+    parser.add_argument("-b", "--block-size", type=int, default=1000, help="number of lines to read at a time")
+    parser.add_argument("-f", "--font", help="font to measure text with, as in contexts.ini. Defaults to the "
+                                             "default context")
+    parser.add_argument("-t", "--tabsize", help="tab size. Defaults to the default context")
+    parser.add_argument("-l", "--latex-by-default", choices=("0", "1"),
+                        help="override latex_by_default from config.ini. Use 0 for files with $...$ spans")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print parser messages to standard error")
+    args = parser.parse_args()
+
+    with contextlib.ExitStack() as stack:
+        if args.input == "-":
+            in_file = sys.stdin
+        else:
+            in_file = stack.enter_context(open(args.input, encoding="utf-8"))
+
+        if args.output == "-":
+            out_file = sys.stdout
+        else:
+            out_file = stack.enter_context(open(args.output, "w", encoding="utf-8"))
+
+        num_lines, elapsed = reformat_file(in_file, out_file, max(1, args.processes), args.block_size, args.font,
+                                           args.tabsize, args.latex_by_default, args.verbose)
+
+    print(f"Reformatted {num_lines} lines in {elapsed:.2f}s ({num_lines / max(elapsed, 1e-9):.0f} lines/s)",
+          file=sys.stderr)
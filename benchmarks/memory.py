@@ -0,0 +1,37 @@
+import gc
+import tracemalloc
+
+from nested import BenchmarkContext
+
+import components
+import font_manager
+import latex_parser
+
+
+def large_selection(num_lines):
+    return [r"f(x_{" + str(i) + r"}) = \frac{x^2 - " + str(i) + r"}{\left( x + \frac{1}{" + str(i) +
+            r"} \right)^2} + \sum_{i=0}^{n} a_i b^{i}" for i in range(num_lines)]
+
+
+def measure_peak(lines, context):
+    gc.collect()
+    tracemalloc.start()
+
+    built = [latex_parser.Tokenizer.tokenize(line).get_component().build(components.BuildContext(context))
+             for line in lines]
+    output = [b.render(context) for b in built]
+
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, output
+
+
+# ----- Main ----- #
+if __name__ == "__main__":
+    context = BenchmarkContext(font_manager.FontInfo(None, monospaced=True))
+    lines = large_selection(500)
+
+    for compact in (False, True):
+        components.compact_line_items = compact
+        peak, _ = measure_peak(lines, context)
+        print(f"compact_line_items={int(compact)}  peak {peak / 1024:>10.1f} KiB")
@@ -0,0 +1,57 @@
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+config.config["Parser"]["show_steps"] = "0"
+
+import font_manager
+import latex_parser
+
+
+class BenchmarkContext:
+    def __init__(self, font_info, tabsize=4):
+        self.font_info = font_info
+        self.tabsize = tabsize
+
+
+def nested_fractions(depth):
+    if depth == 0:
+        return "x"
+    return r"\frac{" + nested_fractions(depth - 1) + r" + 1}{y^" + str(depth) + "}"
+
+
+def nested_brackets(depth):
+    if depth == 0:
+        return "a"
+    return r"\left( " + nested_brackets(depth - 1) + r" + b_{" + str(depth) + r"} \right)"
+
+
+def tall_chain(length):
+    return " + ".join(nested_fractions(i % 8) for i in range(length))
+
+
+def time_tokenize(source, number=20, repeat=5):
+    return min(timeit.repeat(lambda: latex_parser.Tokenizer.tokenize(source), number=number, repeat=repeat)) / number
+
+
+def time_layout(source, context, number=5, repeat=5):
+    component = latex_parser.Tokenizer.tokenize(source).get_component()
+    return min(timeit.repeat(lambda: component.render(context), number=number, repeat=repeat)) / number
+
+
+# ----- Main ----- #
+if __name__ == "__main__":
+    context = BenchmarkContext(font_manager.FontInfo(None, monospaced=True))
+
+    for name, generator in (("fractions", nested_fractions), ("brackets", nested_brackets), ("chain", tall_chain)):
+        for depth in (1, 5, 10, 20, 40, 80):
+            source = generator(depth)
+            tokenize_time = time_tokenize(source) * 1000
+            layout_time = time_layout(source, context) * 1000
+            print(f"{name:<10} depth {depth:>3}  {len(source):>6} chars  "
+                  f"tokenize {tokenize_time:>9.3f} ms  layout {layout_time:>9.3f} ms")
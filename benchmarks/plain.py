@@ -0,0 +1,45 @@
+import timeit
+
+from nested import BenchmarkContext
+
+import config
+import font_manager
+import latex_parser
+
+sources = (
+    r"\alpha \leq \beta",
+    r"\mathbb{R}",
+    r"\forall x \in \mathbb{R}, x \geq 0",
+    r"a + b = c - d",
+    r"\alpha \beta \gamma \delta \epsilon \zeta \eta \theta \iota \kappa \lambda \mu \nu \xi \pi \rho \sigma \tau",
+    r"\mathbb{N} \subset \mathbb{Z} \subset \mathbb{Q} \subset \mathbb{R} \subset \mathbb{C}",
+)
+
+
+def time_full(source, context, number=200, repeat=5):
+    def run():
+        latex_parser.Tokenizer.tokenize(source).get_component().render(context)
+
+    return min(timeit.repeat(run, number=number, repeat=repeat)) / number
+
+
+def time_plain(source, number=200, repeat=5):
+    allow_fraction_shortcut = int(config.config["Parser"]["allow_fraction_shortcut"])
+    return min(timeit.repeat(lambda: latex_parser._format_plain(source, allow_fraction_shortcut), number=number,
+                             repeat=repeat)) / number
+
+
+# ----- Main ----- #
+if __name__ == "__main__":
+    context = BenchmarkContext(font_manager.FontInfo(None, monospaced=True))
+    allow_fraction_shortcut = int(config.config["Parser"]["allow_fraction_shortcut"])
+
+    for source in sources:
+        if latex_parser._format_plain(source, allow_fraction_shortcut) is None:
+            print(f"{source[:40]:<40}  not plain")
+            continue
+
+        full_time = time_full(source, context) * 1000
+        plain_time = time_plain(source) * 1000
+        print(f"{source[:40]:<40}  full {full_time:>8.3f} ms  plain {plain_time:>8.3f} ms  "
+              f"speedup {full_time / plain_time:>6.1f}x")
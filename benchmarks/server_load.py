@@ -0,0 +1,74 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import client
+
+
+def get_source(i):
+    # Vary the input so that requests are not all answered from the render cache
+    kind = i % 4
+    if kind == 0:
+        return rf"\alpha_{{{i}}} \leq \beta"
+    if kind == 1:
+        return rf"\frac{{x^{{{i}}} + 1}}{{y - {i}}}"
+    if kind == 2:
+        return rf"\left( \frac{{a}}{{b + {i}}} \right)^2 = \sum_{{k=0}}^{{{i}}} k"
+    return rf"\mathbb{{R}} \ni {i}"
+
+
+async def run_client(address, client_num, num_requests, options, latencies):
+    reader, writer = await client.open_connection(address)
+
+    try:
+        for i in range(num_requests):
+            start = time.perf_counter()
+            await client.request(reader, writer, get_source(client_num * num_requests + i), **options)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+async def run(address, num_clients, num_requests, options):
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(address, i, num_requests, options, latencies) for i in range(num_clients)))
+    return latencies, time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+# ----- Main ----- #
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure request latency of a running LHF server.")
+    parser.add_argument("-c", "--clients", type=int, default=8, help="number of concurrent clients")
+    parser.add_argument("-n", "--requests", type=int, default=200, help="number of requests sent by each client")
+    parser.add_argument("-f", "--font", help="font to format with, as in contexts.ini")
+    parser.add_argument("-s", "--socket", help="path of the Unix domain socket the server listens on")
+    parser.add_argument("-p", "--port", type=int, help="localhost port the server listens on instead of a Unix domain "
+                                                       "socket")
+    args = parser.parse_args()
+
+    # Matches the options the server was started with, or the address set in config.ini if neither is given
+    if args.port is not None:
+        address = ("127.0.0.1", args.port)
+    elif args.socket is not None:
+        address = args.socket
+    else:
+        address = client.get_address()
+
+    latencies, elapsed = asyncio.run(run(address, args.clients, args.requests,
+                                         {"font": args.font} if args.font else {}))
+    latencies.sort()
+
+    print(f"{len(latencies)} requests from {args.clients} clients in {elapsed:.2f}s "
+          f"({len(latencies) / elapsed:.0f} requests/s)")
+    print(f"p50 {percentile(latencies, 0.5) * 1000:.3f} ms  p90 {percentile(latencies, 0.9) * 1000:.3f} ms  "
+          f"p99 {percentile(latencies, 0.99) * 1000:.3f} ms  max {latencies[-1] * 1000:.3f} ms")
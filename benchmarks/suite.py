@@ -0,0 +1,198 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+
+from nested import BenchmarkContext
+
+import components
+import font_manager
+import formatter
+import latex_parser
+
+corpus_path = os.path.join("benchmarks", "corpus.json")
+
+# Timings only mean anything on the machine they were recorded on, so the baseline is recorded locally rather than kept
+# in the repository
+baseline_path = os.path.join("benchmarks", "baseline.json")
+
+fonts = {
+    "monospaced": lambda: font_manager.FontInfo(None, monospaced=True),
+    "proportional": lambda: font_manager.FontInfo(None),
+}
+
+# Each parsing pass is timed on its own as well as together, including the spacing and compression they all end with
+passes = {
+    "parse.scripts": latex_parser.Tokenizer._SCRIPTS,
+    "parse.functions": latex_parser.Tokenizer._FUNCTIONS,
+    "parse.shortcuts": latex_parser.Tokenizer._SHORTCUTS,
+    "parse": latex_parser.Tokenizer._ALL_PASSES,
+}
+
+
+def time_stage(prepare, func, number, repeat):
+    # Inputs are made fresh for every call, as tokens are consumed when parsed and built components are shared, and
+    # only the call itself is timed. As with timeit, garbage collection is paused. Returns the best of each repeat, in
+    # seconds per call
+    best = None
+    gc_enabled = gc.isenabled()
+    gc.disable()
+
+    try:
+        for _ in range(repeat):
+            total = 0
+
+            for _ in range(number):
+                value = prepare()
+                start_time = time.perf_counter_ns()
+                func(value)
+                total += time.perf_counter_ns() - start_time
+
+            if best is None or total < best:
+                best = total
+
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    return best / number / 1e9
+
+
+def time_expression(source, context, number, repeat):
+    def lex():
+        return latex_parser.Tokenizer._lex(source)
+
+    def tokenize():
+        return latex_parser.Tokenizer.tokenize(source)
+
+    def get_component():
+        return latex_parser.Tokenizer.tokenize(source).get_component()
+
+    def build():
+        return get_component().build(components.BuildContext(context))
+
+    results = {"lex": time_stage(lambda: None, lambda _: lex(), number, repeat)}
+
+    for stage, stage_passes in passes.items():
+        results[stage] = time_stage(lex, lambda tokens: latex_parser.Tokenizer._parse(tokens, stage_passes, {}),
+                                    number, repeat)
+
+    results["get_component"] = time_stage(tokenize, lambda token_group: token_group.get_component(), number, repeat)
+    results["build"] = time_stage(get_component, lambda component: component.build(components.BuildContext(context)),
+                                  number, repeat)
+    results["render"] = time_stage(build, lambda built: built.render(context), number, repeat)
+    return results
+
+
+def time_reformat(source, text_formatter, context, number, repeat):
+    def prepare():
+        latex_parser._parse_cache.clear()
+        latex_parser._render_cache.clear()
+        text_formatter._recent_selections.clear()
+
+    return time_stage(prepare, lambda _: text_formatter.reformat(source, context), number, repeat)
+
+
+def run(corpus, font_names, number, repeat):
+    text_formatter = formatter.Formatter()
+    text_formatter.templates.update(corpus["templates"])
+
+    results = {}
+    for font_name in font_names:
+        context = BenchmarkContext(fonts[font_name]())
+        results[font_name] = {}
+
+        for category, sources in corpus["categories"].items():
+            stages = {}
+
+            for source in sources:
+                # Multi-line selections contain text and template controls, so are only timed as a whole
+                if category != "multiline":
+                    for stage, duration in time_expression(source, context, number, repeat).items():
+                        stages[stage] = stages.get(stage, 0) + duration
+
+                stages["reformat"] = stages.get("reformat", 0) + time_reformat(source, text_formatter, context, number,
+                                                                               repeat)
+
+            results[font_name][category] = stages
+
+    return results
+
+
+def compare(results, baseline, threshold, min_delta):
+    # Yields every stage which is slower than the baseline by more than the threshold, ignoring differences too small
+    # to measure reliably. Stages missing from either side are skipped
+    for font_name, categories in results.items():
+        for category, stages in categories.items():
+            for stage, duration in stages.items():
+                try:
+                    baseline_duration = baseline[font_name][category][stage]
+                except KeyError:
+                    continue
+
+                if duration > baseline_duration * (1 + threshold) and duration - baseline_duration > min_delta:
+                    yield font_name, category, stage, baseline_duration, duration
+
+
+def print_results(results):
+    for font_name, categories in results.items():
+        stage_names = list(dict.fromkeys(stage for stages in categories.values() for stage in stages))
+
+        print(f"{font_name} (ms per corpus category)")
+        print(f"{'':<16}" + "".join(f"{stage:>16}" for stage in stage_names))
+
+        for category, stages in categories.items():
+            print(f"{category:<16}" + "".join(f"{stages[stage] * 1000:>16.3f}" if stage in stages else f"{'-':>16}"
+                                              for stage in stage_names))
+        print()
+
+
+# ----- Main ----- #
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time each stage of the parser and layout over a fixed corpus, and "
+                                                 "check the results against a stored baseline.")
+    parser.add_argument("-c", "--corpus", default=corpus_path, help="JSON file of templates and expressions to time")
+    parser.add_argument("-o", "--output", nargs="?", const=baseline_path,
+                        help=f"write the results to this JSON file, {baseline_path} if no file is given")
+    parser.add_argument("-b", "--baseline", nargs="?", const=baseline_path,
+                        help=f"JSON file of earlier results to compare against, {baseline_path} if no file is given")
+    parser.add_argument("-t", "--threshold", type=float, default=0.25,
+                        help="fraction a stage may slow down by before it counts as a regression")
+    parser.add_argument("-d", "--min-delta", type=float, default=0.05,
+                        help="smallest slowdown in milliseconds which counts as a regression")
+    parser.add_argument("-f", "--font", choices=tuple(fonts), action="append", help="only time with the given font")
+    parser.add_argument("-n", "--number", type=int, default=20, help="calls per repeat")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="repeats, of which the fastest is kept")
+    args = parser.parse_args()
+
+    if args.baseline and not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}. Record one first with --output, before making any changes")
+        sys.exit(2)
+
+    with open(args.corpus, encoding="utf-8") as file:
+        corpus = json.load(file)
+
+    results = run(corpus, args.font or tuple(fonts), args.number, args.repeat)
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"python": platform.python_version(), "number": args.number, "repeat": args.repeat,
+                       "results": results}, file, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)["results"]
+
+        regressions = list(compare(results, baseline, args.threshold, args.min_delta / 1000))
+        for font_name, category, stage, baseline_duration, duration in regressions:
+            print(f"Regression: {font_name} {category} {stage} {baseline_duration * 1000:.3f} ms -> "
+                  f"{duration * 1000:.3f} ms ({duration / baseline_duration - 1:+.0%})")
+
+        if regressions:
+            sys.exit(1)
+
+        print(f"No stage regressed by more than {args.threshold:.0%} against {args.baseline}")
@@ -0,0 +1,83 @@
+import argparse
+import asyncio
+import json
+import socket
+import sys
+
+import config
+
+STREAM_LIMIT = 1 << 24
+
+
+class ServerError(Exception):
+    pass
+
+
+def get_address():
+    # A path for a Unix domain socket where supported, otherwise a (host, port) pair
+    path = config.config["Server"]["socket"]
+    if path and hasattr(socket, "AF_UNIX"):
+        return config.get_path(path)
+
+    return config.config["Server"]["host"], int(config.config["Server"]["port"])
+
+
+async def open_connection(address=None):
+    if address is None:
+        address = get_address()
+
+    if type(address) is str:
+        return await asyncio.open_unix_connection(address, limit=STREAM_LIMIT)
+    return await asyncio.open_connection(*address, limit=STREAM_LIMIT)
+
+
+async def request(reader, writer, text, **options):
+    # Options may be 'font' and 'tabsize', or 'executable' and 'window_title' to use the matching context from
+    # contexts.ini. The default context is used otherwise
+    writer.write(json.dumps({"text": text, **options}).encode("utf-8") + b"\n")
+    await writer.drain()
+
+    line = await reader.readline()
+    if not line:
+        raise ServerError("Connection closed by server")
+
+    response = json.loads(line)
+    if "error" in response:
+        raise ServerError(response["error"])
+
+    return response["output"]
+
+
+def reformat(text, address=None, **options):
+    async def run():
+        reader, writer = await open_connection(address)
+
+        try:
+            return await request(reader, writer, text, **options)
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+    return asyncio.run(run())
+
+
+# ----- Main ----- #
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Format text using a running LHF server.")
+    parser.add_argument("text", nargs="?", help="text to format. Read from standard input if not given")
+    parser.add_argument("-f", "--font", help="font to measure text with, as in contexts.ini")
+    parser.add_argument("-t", "--tabsize", type=float, help="tab size")
+    parser.add_argument("-e", "--executable", help="executable to match a context from contexts.ini with")
+    parser.add_argument("-w", "--window-title", default="", help="window title to match a context with")
+    args = parser.parse_args()
+
+    text = args.text if args.text is not None else sys.stdin.read().rstrip("\n")
+    options = {key: value for key, value in (("font", args.font), ("tabsize", args.tabsize),
+                                              ("executable", args.executable), ("window_title", args.window_title))
+               if value is not None}
+
+    try:
+        print(reformat(text, **options))
+    except (OSError, ServerError) as e:
+        print(f"Could not format text: {e}", file=sys.stderr)
+        sys.exit(1)
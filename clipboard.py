@@ -0,0 +1,64 @@
+import ctypes
+import threading
+import time
+
+import pyperclip
+
+
+def get_sequence_number():
+    # Incremented by Windows whenever the clipboard changes, and much cheaper than reading the clipboard contents
+    return ctypes.windll.user32.GetClipboardSequenceNumber()
+
+
+def wait_for_change(sequence_number, timeout):
+    # Polls with an increasing interval, so that a fast copy is picked up almost immediately without spinning
+    deadline = time.perf_counter() + timeout
+    interval = 0.0005
+
+    while get_sequence_number() == sequence_number:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return False
+
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, 0.004)
+
+    return True
+
+
+class ClipboardRestorer:
+    # Puts back the user's clipboard once the target window has had time to paste, away from the hotkey thread. If
+    # another capture starts first, the pending restore is cancelled and its contents are handed over instead
+    def __init__(self, delay):
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._timer = None
+        self._contents = None
+
+    def take(self):
+        with self._lock:
+            if self._timer is None:
+                return None
+
+            self._timer.cancel()
+            self._timer = None
+            return self._contents
+
+    def schedule(self, contents):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+
+            self._contents = contents
+            self._timer = threading.Timer(self.delay, self._restore)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _restore(self):
+        with self._lock:
+            # A restore cancelled after its timer fired is left to whoever cancelled it
+            if self._timer is not threading.current_thread():
+                return
+
+            self._timer = None
+            pyperclip.copy(self._contents)
@@ -1,24 +1,87 @@
+import array
+import functools
 import itertools
 import math
 
 import config
+import symbol_index
+import timing
+
+# Horizontal positions are accumulated in integer fixed point units to avoid float drift across long rows
+FIXED_POINT_SCALE = 1 << 16
+
+
+def to_fixed_point(value):
+    return round(value * FIXED_POINT_SCALE)
+
+
+def from_fixed_point(value):
+    return value / FIXED_POINT_SCALE
+
+
+class StructuralKey:
+    __slots__ = ("parts", "hash")
+
+    def __init__(self, *parts):
+        self.parts = parts
+        self.hash = hash(parts)
+
+    def __hash__(self):
+        return self.hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        return type(other) is StructuralKey and self.hash == other.hash and self.parts == other.parts
+
+
+class RenderPlan:
+    __slots__ = ("get_text_width", "space_width", "tabsize", "tab_width", "rounding_func", "show_steps")
+
+    _rounding_functions = {
+        "ROUND": round,
+        "FLOOR": math.floor,
+        "CEIL": math.ceil
+    }
+
+    def __init__(self, font_info, tabsize, rounding_function, show_steps):
+        self.get_text_width = font_info.get_text_width
+        self.space_width = font_info.space_width
+        self.tabsize = tabsize
+        self.tab_width = tabsize * font_info.space_width
+
+        self.rounding_func = RenderPlan._rounding_functions[rounding_function]
+        self.show_steps = show_steps
+
+    @staticmethod
+    def get(context):
+        return _get_render_plan(context.font_info, context.tabsize, config.config["Misc"]["rounding_function"],
+                                bool(int(config.config["Parser"]["show_steps"])))
+
+
+@functools.lru_cache(maxsize=32)
+def _get_render_plan(font_info, tabsize, rounding_function, show_steps):
+    return RenderPlan(font_info, tabsize, rounding_function, show_steps)
 
 
 class BuildContext:
-    def __init__(self, context):
+    __slots__ = ("context", "baseline", "height", "built_components")
+
+    def __init__(self, context, built_components=None):
         self.context = context
         self.baseline = 0
         self.height = 1
 
-    def new(self):
-        return BuildContext(self.context)
+        # Built components shared across a single layout pass, keyed by structure
+        self.built_components = {} if built_components is None else built_components
 
-    def update(self, built_component):
-        self.baseline = built_component.baseline
-        self.height = built_component.height
+    def new(self):
+        return BuildContext(self.context, self.built_components)
 
 
 class BuiltComponent:
+    __slots__ = ("width", "height", "lines", "baseline", "alignment")
+
     def __init__(self, width, height, lines, baseline, alignment):
         self.width = width
         self.height = height
@@ -27,11 +90,6 @@ class BuiltComponent:
         self.baseline = baseline
         self.alignment = alignment
 
-    def v_resize(self, height, offset):
-        self.lines = [Line() for _ in range(offset)] + self.lines + \
-                     [Line() for _ in range(height - self.height - offset)]
-        self.height = height
-
     def get_delta(self, other):
         if self.alignment == "bottom":
             return -1 - self.baseline
@@ -41,113 +99,189 @@ class BuiltComponent:
             return other.height - self.baseline
         return None
 
-    def make_similar(self, other):
-        height_delta = other.get_delta(self)
-        height_delta_a = max(0, -height_delta)
-        height_delta_b = max(0, height_delta)
-
-        new_height = max(self.height + height_delta_a, other.height + height_delta_b)
-
-        if self.height != new_height:
-            self.v_resize(new_height, height_delta_a)
-
-        if other.height != new_height:
-            other.v_resize(new_height, height_delta_b)
-
-        self.baseline += height_delta_a
-
-    def combine(self, other):
-        self.make_similar(other)
-
-        for line in other.lines:
-            line.shift(self.width)
-
-        self.lines = [a + b for a, b in zip(self.lines, other.lines)]
-        self.width += other.width
+    def copy(self):
+        lines = [line.copy() for line in self.lines]
+        return BuiltComponent(self.width, self.height, lines, self.baseline, self.alignment)
 
     def render(self, context):
-        return "\n".join(line.render(context) for line in reversed(self.lines))
+        plan = RenderPlan.get(context)
+        return "\n".join(line.render(plan) for line in reversed(self.lines))
 
 
 class Line:
+    # Shifting a line only updates its pending offset. Concatenating lines keeps references to each side, together
+    # with the offset they had at that point, so items are only positioned once when the line is rendered. Item
+    # positions and texts are held in parallel sequences
+    __slots__ = ("offset", "positions", "texts", "children")
+
     def __init__(self, pos=None, text=None):
+        self.offset = 0
+        self.children = ()
+
         if pos is not None:
-            self.items = [(pos, text)]
+            self.positions = (pos,)
+            self.texts = (text,)
         else:
-            self.items = []
+            self.positions = ()
+            self.texts = ()
+
+    def copy(self):
+        # Items and children are never modified in place, so they can be shared between copies
+        new = Line()
+        new.offset = self.offset
+        new.positions = self.positions
+        new.texts = self.texts
+        new.children = self.children
+        return new
 
     def shift(self, offset):
-        self.items = [(pos + offset, text) for pos, text in self.items]
+        self.offset += offset
 
-    def render(self, context):
-        partial = []
+    def get_items(self):
+        items = []
+        stack = [self.get_segment()]
 
-        self.items.sort()
+        while stack:
+            offset, positions, texts, children = stack.pop()
+            items.extend((pos + offset, text) for pos, text in zip(positions, texts))
+            stack.extend((offset + child_offset, child_positions, child_texts, child_children)
+                         for child_offset, child_positions, child_texts, child_children in children)
 
-        tab_width = context.tabsize * context.font_info.space_width
-        last_pos = 0
+        return items
+
+    def render(self, plan):
+        partial = []
 
-        rounding_func = {
-            "ROUND": round,
-            "FLOOR": math.floor,
-            "CEIL": math.ceil
-        }[config.config["Misc"]["rounding_function"]]
+        items = sorted(self.get_items())
 
-        if int(config.config["Parser"]["show_steps"]):
-            print(self.items)
+        if plan.show_steps:
+            timing.note("render.line", items)
 
-        for pos, text in self.items:
+        get_text_width = plan.get_text_width
+        rounding_func = plan.rounding_func
+        space_width = plan.space_width
+        tabsize = plan.tabsize
+        tab_width = plan.tab_width
+        last_pos = 0
+
+        for pos, text in items:
             if not text:
                 continue
 
             delta = max(0, pos - last_pos)
 
-            num_tabs = math.floor(rounding_func(delta / context.font_info.space_width) / context.tabsize)
+            num_tabs = math.floor(rounding_func(delta / space_width) / tabsize)
             delta -= num_tabs * tab_width
             last_pos += num_tabs * tab_width
 
-            num_spaces = rounding_func(delta / context.font_info.space_width)
-            last_pos += num_spaces * context.font_info.space_width
-
-            new = "\t" * num_tabs + " " * num_spaces + text
-            last_pos += context.font_info.get_text_width(text)
+            num_spaces = rounding_func(delta / space_width)
+            last_pos += num_spaces * space_width
 
-            partial.append(new)
+            partial.append("\t" * num_tabs + " " * num_spaces + text)
+            last_pos += get_text_width(text)
 
         return "".join(partial).rstrip(" ")
 
     def get_raw(self):
-        return "".join(x[2] for x in self.items)
+        return "".join(text for _, text in sorted(self.get_items()))
+
+    @staticmethod
+    def from_segments(segments):
+        new = Line()
+
+        if len(segments) == 1:
+            new.offset, new.positions, new.texts, new.children = segments[0]
+        elif compact_line_items:
+            # Resolve positions straight away so that only two flat arrays are kept alive, rather than every line
+            # the segments came from
+            new.children = tuple(segments)
+            items = new.get_items()
+            new.positions = array.array("d", (pos for pos, _ in items))
+            new.texts = tuple(text for _, text in items)
+            new.children = ()
+        else:
+            new.children = tuple(segments)
+
+        return new
+
+    def get_segment(self, offset=0):
+        return self.offset + offset, self.positions, self.texts, self.children
+
+    def is_empty(self):
+        return not self.texts and not self.children
 
     def __add__(self, other):
+        if other.is_empty():
+            return self.copy()
+        if self.is_empty():
+            return other.copy()
+
         new = Line()
-        new.items = self.items + other.items
+        new.children = (self.get_segment(), other.get_segment())
         return new
 
     def __repr__(self):
-        return "<Line: " + ", ".join("{:.2f}: {}".format(pos, text) for pos, text in self.items) + ">"
+        return "<Line: " + ", ".join("{:.2f}: {}".format(pos, text) for pos, text in sorted(self.get_items())) + ">"
 
 
 class Component:
+    __slots__ = ("_key",)
+
+    def __init__(self):
+        self._key = None
+
+    def get_key(self):
+        if self._key is None:
+            self._key = self._get_key()
+        return self._key
+
+    def _get_key(self):
+        return StructuralKey(type(self))
+
+    def get_build_key(self, build_context):
+        return self.get_key()
+
     def build(self, build_context):
+        # Identical subtrees are only built once per layout pass. The result is shared, so callers which modify it
+        # must take a copy first
+        key = self.get_build_key(build_context)
+
+        if (built := build_context.built_components.get(key)) is None:
+            built = self._build(build_context)
+            build_context.built_components[key] = built
+
+        return built
+
+    def _build(self, build_context):
         return BuiltComponent(0, 0, [], 0, "inline")
 
     def render(self, context):
-        build_context = BuildContext(context)
-        return self.build(build_context).render(context)
+        start_time = timing.start()
+        built = self.build(BuildContext(context))
+        timing.stop("build", start_time)
+
+        start_time = timing.start()
+        rendered = built.render(context)
+        timing.stop("render", start_time)
+        return rendered
 
 
 class TextComponent(Component):
+    __slots__ = ("text",)
+
     def __init__(self, text):
         super().__init__()
         self.text = list(reversed(text.split("\n")))
 
+    def _get_key(self):
+        return StructuralKey(TextComponent, *self.text)
+
     @staticmethod
     def _center(context, text, width):
         pos = max(0, width - context.font_info.get_text_width(text)) / 2
         return pos, text
 
-    def build(self, build_context):
+    def _build(self, build_context):
         width = max(build_context.context.font_info.get_text_width(line) for line in self.text)
         height = len(self.text)
 
@@ -158,32 +292,91 @@ class TextComponent(Component):
 
 
 class ComponentContainer(Component):
+    __slots__ = ("components",)
+
     def __init__(self):
         super().__init__()
         self.components = []
 
     def add_component(self, component):
         self.components.append(component)
+        self._key = None
 
     def add_components(self, components):
         self.components.extend(components)
+        self._key = None
 
-    def build(self, build_context):
+    def _get_key(self):
+        return StructuralKey(type(self), *(component.get_key() for component in self.components))
+
+    def _build(self, build_context):
         if len(self.components) == 0:
-            return BuiltComponent(0, 1, [], 0, "inline")
+            return BuiltComponent(0, 1, [Line()], 0, "inline")
 
+        # Measure each component in turn, tracking the size of the row built so far. Each component is padded below
+        # to line up with the row, and padding added below the row raises everything already in it. Line counts may
+        # be lower than heights, in which case the shorter side cuts off the top of the other
         new_context = build_context.new()
-        built = self.components[0].build(new_context)
-        new_context.update(built)
+        placements = []
+        cutoffs = []
+
+        first = self.components[0].build(new_context)
+        width = to_fixed_point(first.width)
+        height = first.height
+        baseline = first.baseline
+        num_lines = len(first.lines)
+        padding = 0
+
+        placements.append((first, 0, 0, 0))
+        new_context.baseline, new_context.height = baseline, height
 
         for c in itertools.islice(self.components, 1, len(self.components)):
-            built.combine(c.build(new_context))
-            new_context.update(built)
+            built = c.build(new_context)
 
-        return built
+            height_delta = built.get_delta(new_context)
+            height_delta_a = max(0, -height_delta)
+            height_delta_b = max(0, height_delta)
+
+            new_height = max(height + height_delta_a, built.height + height_delta_b)
+            other_num_lines = len(built.lines) + new_height - built.height
+            num_lines += new_height - height
+            num_lines = min(num_lines, other_num_lines)
+
+            padding += height_delta_a
+            placements.append((built, width, height_delta_b, padding))
+            cutoffs.append((num_lines, padding))
+
+            width += to_fixed_point(built.width)
+            height = new_height
+            baseline += height_delta_a
+            new_context.baseline, new_context.height = baseline, height
+
+        # Arrange every line at its final position in one go
+        # A component is cut off by its own step and every later one. The first component only by later ones
+        cutoff = num_lines
+        placement_cutoffs = []
+        for step_num_lines, step_padding in reversed(cutoffs):
+            cutoff = min(cutoff, step_num_lines + padding - step_padding)
+            placement_cutoffs.append(cutoff)
+        placement_cutoffs.append(cutoff)
+        placement_cutoffs.reverse()
+
+        segments = [[] for _ in range(num_lines)]
+        for (built, x, height_delta_b, join_padding), cutoff in zip(placements, placement_cutoffs):
+            offset = from_fixed_point(x)
+            y = height_delta_b + padding - join_padding
+
+            for line in itertools.islice(built.lines, max(0, cutoff - y)):
+                segments[y].append(line.get_segment(offset))
+                y += 1
+
+        lines = [Line.from_segments(line_segments) if line_segments else Line() for line_segments in segments]
+        return BuiltComponent(from_fixed_point(width), height, lines, baseline, first.alignment)
 
 
 class Fraction(Component):
+    __slots__ = ("top", "bottom", "div_char_simple", "div_char_complex", "overfill")
+
     def __init__(self, top, bottom, div_char_simple, div_char_complex, overfill):
         super().__init__()
         self.top = top
@@ -193,6 +386,10 @@ class Fraction(Component):
         self.div_char_complex = div_char_complex
         self.overfill = overfill
 
+    def _get_key(self):
+        return StructuralKey(Fraction, self.top.get_key(), self.bottom.get_key(), self.div_char_simple,
+                             self.div_char_complex, self.overfill)
+
     def _build_simple(self, top_simplified, bottom_simplified, build_context):
         raw_line = top_simplified + self.div_char_simple + bottom_simplified
 
@@ -202,8 +399,8 @@ class Fraction(Component):
         return BuiltComponent(width, 1, lines, 0, "inline")
 
     def _build_complex(self, build_context):
-        top_built = self.top.build(build_context.new())
-        bottom_built = self.bottom.build(build_context.new())
+        top_built = self.top.build(build_context.new()).copy()
+        bottom_built = self.bottom.build(build_context.new()).copy()
 
         div_char_width = build_context.context.font_info.get_text_width(self.div_char_complex)
         divider = self.div_char_complex * (
@@ -225,7 +422,7 @@ class Fraction(Component):
 
         return BuiltComponent(width, len(lines), lines, baseline, "inline")
 
-    def build(self, build_context):
+    def _build(self, build_context):
         top_simple, top_simplified = ScriptGroup.simplify_superscript(self.top)
         bottom_simple, bottom_simplified = ScriptGroup.simplify_subscript(self.bottom)
 
@@ -236,6 +433,8 @@ class Fraction(Component):
 
 
 class FlexChars:
+    __slots__ = ("single", "double_top", "double_bottom", "top", "top_mid", "mid", "bottom_mid", "bottom", "filler")
+
     def __init__(self, single, double_top, double_bottom, top, top_mid, mid, bottom_mid, bottom, filler):
         self.single = single
 
@@ -276,13 +475,18 @@ class FlexChars:
 
 
 class FlexibleGroup(ComponentContainer):
+    __slots__ = ("left_chars", "right_chars")
+
     def __init__(self, left_chars, right_chars):
         super().__init__()
         self.left_chars = left_chars
         self.right_chars = right_chars
 
-    def build(self, build_context):
-        built = super().build(build_context.new())
+    def _get_key(self):
+        return StructuralKey(super()._get_key(), self.left_chars, self.right_chars)
+
+    def _build(self, build_context):
+        built = super()._build(build_context.new())
 
         left_chars = list(self.left_chars.get_chars(built.height))
         right_chars = list(self.right_chars.get_chars(built.height))
@@ -302,19 +506,20 @@ class FlexibleGroup(ComponentContainer):
 
 
 class ScriptGroup(Component):
-    with open("symbols/subscript.txt", encoding="utf-8") as file:
-        items = (line.strip().split(" ") for line in file.readlines())
-        _subscript_chars = {a: b for a, b in items}
-
-    with open("symbols/superscript.txt", encoding="utf-8") as file:
-        items = (line.strip().split(" ") for line in file.readlines())
-        _superscript_chars = {a: b for a, b in items}
+    __slots__ = ("subscript", "superscript")
 
     def __init__(self, subscript, superscript):
         super().__init__()
         self.subscript = subscript
         self.superscript = superscript
 
+    def _get_key(self):
+        return StructuralKey(ScriptGroup, self.subscript.get_key(), self.superscript.get_key())
+
+    def get_build_key(self, build_context):
+        # Layout of scripts depends on the surrounding components
+        return StructuralKey(self.get_key(), build_context.baseline, build_context.height)
+
     @staticmethod
     def _simplify(component, char_set):
         if type(component) is ComponentContainer:
@@ -344,24 +549,24 @@ class ScriptGroup(Component):
 
     @staticmethod
     def simplify_superscript(component):
-        return ScriptGroup._simplify(component, ScriptGroup._superscript_chars)
+        return ScriptGroup._simplify(component, symbol_index.load().superscript_chars)
 
     @staticmethod
     def simplify_subscript(component):
-        return ScriptGroup._simplify(component, ScriptGroup._subscript_chars)
+        return ScriptGroup._simplify(component, symbol_index.load().subscript_chars)
 
-    def build(self, build_context):
+    def _build(self, build_context):
         bottom_simple, bottom_simplified = ScriptGroup.simplify_subscript(self.subscript)
         if bottom_simple:
-            subscript = TextComponent(bottom_simplified).build(build_context.new())
+            subscript = TextComponent(bottom_simplified).build(build_context.new()).copy()
         else:
-            subscript = self.subscript.build(build_context.new())
+            subscript = self.subscript.build(build_context.new()).copy()
 
         top_simple, top_simplified = ScriptGroup.simplify_superscript(self.superscript)
         if top_simple:
-            superscript = TextComponent(top_simplified).build(build_context.new())
+            superscript = TextComponent(top_simplified).build(build_context.new()).copy()
         else:
-            superscript = self.superscript.build(build_context.new())
+            superscript = self.superscript.build(build_context.new()).copy()
 
         if bottom_simple and top_simple and build_context.height == 1:
             superscript.lines[0].shift(subscript.width)
@@ -390,6 +595,8 @@ class ScriptGroup(Component):
 
 
 # ------ Main ----- #
+compact_line_items = bool(int(config.config["Misc"]["compact_line_items"]))
+
 bracket_group_arguments = {
     "(": (FlexChars(*"(⎧⎩⎧⎪⎪⎪⎩⎪"), FlexChars(*")⎫⎭⎫⎪⎪⎪⎭⎪")),
     "{": (FlexChars(*"{⎰⎱⎧⎭⎨⎫⎩⎢"), FlexChars(*"}⎱⎰⎫⎩⎬⎧⎭⎪")),
@@ -1,7 +1,25 @@
 import configparser
+import os
+
+
+def get_path(path):
+    # Data files are found relative to the program rather than the working directory, so it can be run from anywhere
+    return os.path.join(_directory, path)
+
+
+def load(path):
+    # Settings are replaced in place, so modules which read them as they are used see the new values. Settings which are
+    # read on import, such as cache sizes and font locations, only apply to modules imported afterwards
+    parser = configparser.ConfigParser()
+    with open(path, encoding="utf-8") as file:
+        parser.read_file(file)
+
+    config.clear()
+    config.update({section: dict(contents) for section, contents in dict(parser).items() if section != "DEFAULT"})
+
 
 # ----- Main ----- #
-_parser = configparser.ConfigParser()
-_parser.read("./config.ini", encoding="utf-8")
+_directory = os.path.dirname(os.path.abspath(__file__))
 
-config = {section: dict(contents) for section, contents in dict(_parser).items() if section != "DEFAULT"}
+config = {}
+load(os.environ.get("LHF_CONFIG", get_path("config.ini")))
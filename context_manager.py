@@ -1,19 +1,15 @@
 import configparser
 import ctypes
 import ctypes.wintypes
+import functools
 import os
 import re
 import sys
+import threading
 
 import config
 import font_manager
-
-if sys.platform in ("linux", "linux2"):
-    raise NotImplementedError(f"Linux is not currently supported")
-elif sys.platform in ("Windows", "win32", "cygwin"):
-    pass
-else:
-    raise EnvironmentError(f"Unknown platform {sys.platform}")
+import timing
 
 
 class Context:
@@ -21,10 +17,29 @@ class Context:
         self.executable = executable
         self.window_title = window_title
 
-        self.font_info = self._get_font_info(entry["font"])
+        if executable is not None:
+            self._executable_pattern = re.compile(executable)
+            self._window_title_pattern = re.compile(window_title)
+
+        self.font = entry["font"]
         self.tabsize = float(entry["tabsize"])
+        self._font_info = None
+
+    @property
+    def font_info(self):
+        # Fonts are shared between contexts with the same font, and kept by each context once loaded. Only the most
+        # recently used fonts are kept otherwise, so fonts requested by name cannot build up
+        if (font_info := self._font_info) is not None:
+            return font_info
+
+        with _font_info_lock:
+            if self._font_info is None:
+                self._font_info = self._get_font_info(self.font)
+
+        return self._font_info
 
     @staticmethod
+    @functools.lru_cache(maxsize=int(config.config["Misc"]["font_cache_size"]))
     def _get_font_info(family_names):
         if family_names == "MONOSPACED":
             return font_manager.FontInfo(None, monospaced=True)
@@ -40,11 +55,21 @@ class Context:
         return font_manager.FontInfo(families)
 
     def check_match(self, executable, window_title):
-        return re.fullmatch(self.executable, executable) and re.fullmatch(self.window_title, window_title)
+        return self._executable_pattern.fullmatch(executable) and self._window_title_pattern.fullmatch(window_title)
 
     def __repr__(self):
         return f"<Context exe='{self.executable}' title='{self.window_title}' " \
-               f"font={repr(self.font_info)} tabsize={self.tabsize}>"
+               f"font='{self.font}' tabsize={self.tabsize}>"
+
+
+def check_platform():
+    # Only matching the focused window is platform specific, so contexts can still be created and used elsewhere
+    if sys.platform in ("linux", "linux2"):
+        raise NotImplementedError(f"Linux is not currently supported")
+    elif sys.platform in ("Windows", "win32", "cygwin"):
+        pass
+    else:
+        raise EnvironmentError(f"Unknown platform {sys.platform}")
 
 
 def _get_window():
@@ -74,9 +99,10 @@ def _get_window_windows():
     return executable, title.value
 
 
-def get_context():
-    executable, window_title = _get_window()
-
+@functools.lru_cache(maxsize=int(config.config["Misc"]["context_cache_size"]))
+def _match_context(executable, window_title):
+    # Each context's patterns are matched on their own, as they may use anchors, inline flags or groups of their own.
+    # The same few windows are matched over and over, so results are cached per window instead
     for c in contexts:
         if c.check_match(executable, window_title):
             return c
@@ -84,9 +110,43 @@ def get_context():
     return default_context
 
 
+@timing.timed("context")
+def get_context(window=None):
+    # The window may be given as (executable, window title) instead of using the focused window
+    executable, window_title = window if window is not None else _get_window()
+    c = _match_context(executable, window_title)
+
+    # Resolve the font before returning so that loading is never deferred into layout
+    _ = c.font_info
+    return c
+
+
+@functools.lru_cache(maxsize=int(config.config["Misc"]["font_cache_size"]))
+def get_font_context(font, tabsize=None):
+    entry = dict(default_entry)
+    entry["font"] = font
+
+    if tabsize is not None:
+        entry["tabsize"] = tabsize
+
+    return Context(None, None, entry)
+
+
+def _prefetch_fonts():
+    for c in (default_context, *contexts):
+        _ = c.font_info
+
+
+def start_prefetch():
+    if int(config.config["Fonts"]["prefetch"]):
+        threading.Thread(target=_prefetch_fonts, daemon=True).start()
+
+
 # ----- Main ----- #
+_font_info_lock = threading.Lock()
+
 parser = configparser.ConfigParser()
-parser.read("./contexts.ini", encoding="utf-8")
+parser.read(config.get_path("contexts.ini"), encoding="utf-8")
 
 default_entry = dict(parser["DEFAULT"])
 default_context = Context(None, None, default_entry)
@@ -0,0 +1,94 @@
+import functools
+import re
+
+
+class ScannedLine:
+    # A single line of a selection, with the templates, history entries and LaTeX spans found within it. Positions are
+    # offsets into the whole selection. Each template and history entry is (start, end, before, argument), where
+    # 'before' holds the escaped backslashes preceding the control, which are kept. Each span is
+    # (start, end, before, content). 'flag' is "t" or "r" if the line starts with either control
+    __slots__ = ("start", "end", "flag", "templates", "history", "spans")
+
+    def __init__(self, start, flag):
+        self.start = start
+        self.end = None
+        self.flag = flag
+        self.templates = []
+        self.history = []
+        self.spans = []
+
+
+class Scanner:
+    # Splits a selection into formatting controls, LaTeX spans between '$' and the text around them. Only the
+    # characters which can start a control are examined, with a pattern built once for each prefix. A control or '$'
+    # preceded by an odd number of backslashes is escaped. History recalls must also start a word, so that text such as
+    # 'stdio.h' is left alone
+    def __init__(self, prefix):
+        self.prefix = prefix
+        escaped_prefix = re.escape(prefix)
+
+        self._selection_pattern = re.compile(
+            fr"{escaped_prefix}(?:(?P<timings>timings)|(?P<list_templates>lt)"
+            fr"|s\[(?P<save>[\w\d\s]+?)] ?(?P<template>[\w\W]+)|d\[(?P<delete>[\w\d\s]+?)]"
+            fr"|lh\[(?P<list_history>\d+)]|(?P<recall>h)(?:\[\d+])?)")
+
+        self._token_pattern = re.compile(
+            fr"(?<![^\s])(\\*){escaped_prefix}h(?:\[(\d+)](?!\w)|(?!\w))"
+            fr"|(\\*)(?:{escaped_prefix}l\[((?:(?!\n)[\w\d\s])+?)]|(\$))|(\n)")
+
+    def match_selection(self, text):
+        # Controls which can only be used on their own. Returns the name of the control and the match, or None
+        if (match := self._selection_pattern.fullmatch(text)) is None:
+            return None
+
+        for name in ("timings", "list_templates", "save", "delete", "list_history", "recall"):
+            if match.group(name) is not None:
+                return name, match
+
+    def scan(self, text):
+        lines = []
+        line = self._start_line(text, 0)
+        dollar = None
+
+        for match in self._token_pattern.finditer(text):
+            if match.start(6) >= 0:
+                line.end = match.start()
+                lines.append(line)
+                line = self._start_line(text, match.end())
+                dollar = None
+                continue
+
+            before = match.group(1) if match.start(1) >= 0 else match.group(3)
+            if len(before) % 2:
+                continue
+
+            if match.start(5) >= 0:
+                # Spans are paired from left to right. Backslashes before the closing '$' are dropped
+                if dollar is None:
+                    dollar = match
+                else:
+                    line.spans.append((dollar.start(), match.end(), dollar.group(3), text[dollar.end():match.start()]))
+                    dollar = None
+            elif match.start(4) >= 0:
+                line.templates.append((match.start(), match.end(), before, match.group(4)))
+            else:
+                line.history.append((match.start(), match.end(), before, match.group(2)))
+
+        line.end = len(text)
+        lines.append(line)
+        return lines
+
+    def _start_line(self, text, start):
+        if text.startswith(self.prefix + "t", start):
+            flag = "t"
+        elif text.startswith(self.prefix + "r", start):
+            flag = "r"
+        else:
+            flag = None
+
+        return ScannedLine(start, flag)
+
+
+@functools.lru_cache(maxsize=8)
+def get_scanner(prefix):
+    return Scanner(prefix)
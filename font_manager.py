@@ -1,16 +1,97 @@
+import bisect
+import functools
+import glob
+import hashlib
+import mmap
+import os
+import string
+import struct
+
 import pyglet.font
 
 import config
 
 _dpi = int(config.config["Fonts"]["dpi"])
+_cache_directory = config.get_path(config.config["Fonts"]["cache_directory"])
+_cache_size = int(config.config["Fonts"]["cache_size"])
+_glyph_width_cache_size = int(config.config["Misc"]["glyph_width_cache_size"])
+_text_width_cache_size = int(config.config["Misc"]["text_width_cache_size"])
+
+
+class AdvanceTable:
+    _header = struct.Struct("<4s32sI")
+    _magic = b"LHFA"
+
+    def __init__(self, file, signature):
+        self._file = file
+        self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, file_signature, length = AdvanceTable._header.unpack_from(self._map)
+        if magic != AdvanceTable._magic or file_signature != signature \
+                or len(self._map) != AdvanceTable._header.size + length * 8:
+            self.close()
+            raise ValueError("Advance table is invalid or out of date")
+
+        view = memoryview(self._map)[AdvanceTable._header.size:]
+        self._codepoints = view[:length * 4].cast("I")
+        self._widths = view[length * 4:].cast("f")
+
+    @staticmethod
+    def load(path, signature):
+        try:
+            file = open(path, "rb")
+        except OSError:
+            return None
+
+        try:
+            return AdvanceTable(file, signature)
+        except (ValueError, struct.error):
+            file.close()
+            return None
+
+    @staticmethod
+    def build(path, signature, font, chars):
+        codepoints = sorted(ord(char) for char in chars)
+        widths = [font.get_glyphs(chr(codepoint))[0].width for codepoint in codepoints]
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as file:
+            file.write(AdvanceTable._header.pack(AdvanceTable._magic, signature, len(codepoints)))
+            file.write(struct.pack(f"<{len(codepoints)}I", *codepoints))
+            file.write(struct.pack(f"<{len(widths)}f", *widths))
+        os.replace(temp_path, path)
+
+    def get(self, char, default=None):
+        codepoint = ord(char)
+        index = bisect.bisect_left(self._codepoints, codepoint)
+
+        if index < len(self._codepoints) and self._codepoints[index] == codepoint:
+            return self._widths[index]
+        return default
+
+    def close(self):
+        self._codepoints = self._widths = None
+        self._map.close()
+        self._file.close()
+
+    def __len__(self):
+        return len(self._codepoints)
 
 
 class FontInfo:
+    _sample_chars = "0MWgil"
+
     def __init__(self, families, monospaced=False):
+        self.get_char_width = functools.lru_cache(maxsize=_glyph_width_cache_size)(self._get_char_width)
+        self.get_text_width = functools.lru_cache(maxsize=_text_width_cache_size)(self._get_text_width)
+        self.advance_table = None
+
         if not monospaced:
             self.families = families
             self.monospaced = False
             self.font = pyglet.font.load(families, dpi=_dpi)
+            self.advance_table = FontInfo._get_advance_table(families, self.font)
 
             self.em = self.font.get_glyphs(" ")[0].height
             self.space_width = self.get_char_width(" ")
@@ -23,21 +104,62 @@ class FontInfo:
             self.em = _font.get_glyphs(" ")[0].height
             self.space_width = self.em
 
-    def get_char_width(self, char):
+    @staticmethod
+    def _get_advance_table(families, font):
+        chars = _get_table_chars()
+        signature = hashlib.sha256(repr((families, getattr(font, "name", None), _dpi, _get_font_files(),
+                                         sorted(chars))).encode()).digest()
+
+        name = hashlib.sha1(repr(families).encode()).hexdigest()
+        path = os.path.join(_cache_directory, name + ".lhfa")
+
+        # The families may resolve to a different face than when the table was built without any font file changing,
+        # such as a system font which has been updated, so a few advances are also checked against the loaded font
+        table = AdvanceTable.load(path, signature)
+        if table is not None and not FontInfo._check_advance_table(table, font):
+            table.close()
+            table = None
+
+        if table is not None:
+            _touch(path)
+            return table
+
+        try:
+            AdvanceTable.build(path, signature, font, chars)
+        except OSError as e:
+            # Widths are measured from the font instead, if the cache cannot be written to
+            print(f"Could not write advance table '{path}': {e}")
+            return None
+
+        _prune_cache()
+        return AdvanceTable.load(path, signature)
+
+    @staticmethod
+    def _check_advance_table(table, font):
+        for char in FontInfo._sample_chars:
+            width = struct.unpack("<f", struct.pack("<f", font.get_glyphs(char)[0].width))[0]
+            if table.get(char) != width:
+                return False
+
+        return True
+
+    def _get_char_width(self, char):
         if self.monospaced:
             return self.space_width
 
-        print(repr(char), self.font.get_glyphs(char)[0].width)
+        if self.advance_table is not None and (width := self.advance_table.get(char)) is not None:
+            return width
+
         return self.font.get_glyphs(char)[0].width
 
-    def get_text_width(self, text):
+    def _get_text_width(self, text):
         if self.monospaced:
             return self.space_width * len(text)
 
-        for char in text:
-            print(repr(char), self.get_char_width(char))
+        return sum(self.get_char_width(char) for char in text)
 
-        return sum(glyph.width for glyph in self.font.get_glyphs(text))
+    def cache_info(self):
+        return {"glyph_width": self.get_char_width.cache_info(), "text_width": self.get_text_width.cache_info()}
 
     def __repr__(self):
         if self.monospaced:
@@ -49,10 +171,63 @@ def font_exists(font_name):
     return pyglet.font.have_font(font_name)
 
 
+@functools.lru_cache(maxsize=None)
+def _get_table_chars():
+    chars = set(string.printable)
+
+    for path in glob.glob(config.get_path("symbols/*.txt")):
+        with open(path, encoding="utf-8") as file:
+            chars.update(file.read())
+
+    return frozenset(char for char in chars if char == " " or not char.isspace())
+
+
+def _touch(path):
+    # Tables are pruned least recently used first, so using one marks it as recent. The cache may be read only
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _prune_cache():
+    # A table is written for every font specification used, which may be any font given to the server, so only the
+    # most recently used tables are kept
+    try:
+        paths = [entry.path for entry in os.scandir(_cache_directory) if entry.name.endswith(".lhfa")]
+        paths.sort(key=os.path.getmtime, reverse=True)
+    except OSError:
+        return
+
+    for path in paths[_cache_size:]:
+        try:
+            os.remove(path)
+        except OSError:
+            # Tables still mapped cannot be removed on some platforms, and are left for a later prune
+            pass
+
+
+@functools.lru_cache(maxsize=None)
+def _get_font_files():
+    font_files = []
+
+    for directory in font_directories:
+        for root, _, files in os.walk(directory):
+            for file in files:
+                path = os.path.join(root, file)
+                stat = os.stat(path)
+                font_files.append((path, stat.st_mtime_ns, stat.st_size))
+
+    return tuple(sorted(font_files))
+
+
 # ----- Main ----- #
-pyglet.font.add_directory("./fonts")
+font_directories = [config.get_path("fonts")]
 
 locations = config.config["Fonts"]["locations"].split(", ")
 for location in locations:
     if location:
-        pyglet.font.add_directory(location)
+        font_directories.append(config.get_path(location))
+
+for directory in font_directories:
+    pyglet.font.add_directory(directory)
@@ -1,145 +1,277 @@
-import csv
-import re
-import threading
-import time
+import collections
+import logging
+import os
 
 import config
 import context_manager
+import controls
+import history
 import latex_parser
+import template_store
+import timing
+
+
+class Formatter:
+    # Formats text for an explicitly given context, without reference to the focused window. Templates and history are
+    # only read from and saved to disk if paths are given. Templates are written as they change, so nothing runs in the
+    # background until a template is saved or deleted. A config file and symbol index may also be given, though settings
+    # are shared by the whole process, so these replace the ones used by every formatter
+    def __init__(self, templates_path=None, history_path=None, config_path=None, symbol_index_path=None):
+        if config_path is not None:
+            config.load(config_path)
+        if symbol_index_path is not None:
+            config.config["Misc"]["symbol_index"] = os.path.abspath(symbol_index_path)
+
+        self.templates_path = templates_path
+        self.templates = template_store.TemplateStore(templates_path,
+                                                      float(config.config["Misc"]["template_compact_delay"]))
+        self.history = history.History(history_path, int(config.config["Misc"]["history_size"]),
+                                       int(config.config["Misc"]["history_buffer_size"]))
+
+        # The LaTeX within each template which has been saved or loaded since starting, by template name. These are
+        # pinned in the parser, so that formatting a loaded template does not parse it again
+        self._pinned_templates = {}
+
+        # The output of each line and LaTeX span in the last few selections, along with the settings they were formatted
+        # with, so that reformatting a selection after a small change only formats the lines and spans which changed
+        self._recent_selections = collections.deque(maxlen=int(config.config["Misc"]["recent_selections"]))
+
+    def close(self):
+        self.templates.close()
+        self.history.close()
+
+    def _pin_template(self, name):
+        if name in self._pinned_templates:
+            return
+
+        contents = []
+
+        def collect(before, content):
+            contents.append(content)
+            return ""
 
-_context = None
-
-
-def _template_saver():
-    global _saved_templates
-
-    save_frequency = float(config.config["Misc"]["template_save_frequency"])
-
-    while True:
-        time.sleep(save_frequency)
-
-        if _saved_templates != _templates:
-            _save_templates(_templates)
-            _saved_templates = _templates.copy()
+        template = self.templates[name]
+        for line in controls.get_scanner(config.config["Formatting Controls"]["prefix"]).scan(template):
+            self._format_line(template, line, collect)
+
+        pinned = self._pinned_templates[name] = []
+        for content in contents:
+            try:
+                if latex_parser.pin(content):
+                    pinned.append(content)
+            except (latex_parser.Tokenizer.TokenizationError, latex_parser.Tokenizer.BuildError):
+                # Reported when the template is formatted instead
+                pass
+
+    def _unpin_template(self, name):
+        for content in self._pinned_templates.pop(name, ()):
+            latex_parser.unpin(content)
+
+    def _substitute_template(self, before, name):
+        if name not in self.templates:
+            prefix = config.config["Formatting Controls"]["prefix"]
+            return fr"{prefix}l[{name}]"
+
+        self._pin_template(name)
+        return before + self.templates[name]
+
+    def _substitute_history(self, before, entry_num):
+        if (entry := self.history.get(int(entry_num or 1))) is None:
+            return None
+
+        return before + entry[1]
+
+    @staticmethod
+    def _substitute_latex(before, content, context):
+        try:
+            parsed = latex_parser.parse(content, context)
+        except latex_parser.Tokenizer.TokenizationError as e:
+            _logger.info(e)
+            parsed = content
+        except latex_parser.Tokenizer.BuildError as e:
+            _logger.info(e)
+            parsed = content
+
+        if len(parsed.split("\n")) > 1:
+            return before + "\n" + parsed + "\n"
+
+        return parsed
+
+    def reformat(self, original, context):
+        # The context may be given as a font specification, as used in contexts.ini
+        if type(context) is str:
+            context = context_manager.get_font_context(context)
+
+        _logger.debug("%s %s", original, context)
+
+        scanner = controls.get_scanner(config.config["Formatting Controls"]["prefix"])
+        control, match = scanner.match_selection(original) or (None, None)
+
+        if control == "timings":
+            return timing.dump()
+
+        if control == "list_templates":
+            if self.templates:
+                return "All templates: " + ", ".join(name for name in self.templates)
+            return "No templates"
+
+        if control == "save":
+            name, template = match.group("save", "template")
+            self._unpin_template(name)
+            self.templates[name] = template
+            self._pin_template(name)
+            return ""
 
+        if control == "delete":
+            name = match.group("delete")
+
+            if name in self.templates:
+                self._unpin_template(name)
+                del self.templates[name]
+                return ""
+
+            return fr"\d[{name}]"
+
+        if control == "list_history":
+            entries = []
+            for entry_num in range(1, int(match.group("list_history")) + 1):
+                if (entry := self.history.get(entry_num)) is None:
+                    break
+                entries.append(f"{entry_num}: {entry[1]}")
+
+            return "\n".join(entries) if entries else "No history"
+
+        # Lines and spans are found by their contents, in selections formatted with the same settings. Nothing is reused
+        # while showing steps, so that every step is still shown
+        show_steps = int(config.config["Parser"]["show_steps"])
+        settings = (context.font_info, context.tabsize, scanner.prefix,
+                    config.config["Formatting Controls"]["latex_by_default"],
+                    config.config["Parser"]["allow_fraction_shortcut"], config.config["Misc"]["rounding_function"])
+        recent = [] if show_steps else [outputs for key, outputs in self._recent_selections if key == settings]
+        outputs = {}
+
+        def find_recent(key):
+            for recent_outputs in reversed(recent):
+                if (recent_output := recent_outputs.get(key)) is not None:
+                    return recent_output
+            return None
+
+        def substitute_latex(before, content):
+            if (new := find_recent((before, content))) is None:
+                new = Formatter._substitute_latex(before, content, context)
+
+            outputs[before, content] = new
+            return new
+
+        new_lines = []
+        for line in scanner.scan(original):
+            if line.templates:
+                # Templates may themselves contain history controls, so these are found again once substituted
+                text = Formatter._splice(original, line.start, line.end, line.templates, self._substitute_template)
+                history_entries = [entry for scanned in scanner.scan(text) for entry in scanned.history]
+                new_lines.append(Formatter._splice(text, 0, len(text), history_entries, self._substitute_history))
+
+            elif line.history:
+                new_lines.append(self._format_recalls(original, line, substitute_latex))
 
-def _save_templates(templates):
-    global _saved_templates
+            else:
+                text = original[line.start:line.end]
 
-    with open("./templates.csv", "w", newline="", encoding="utf-8") as file:
-        writer = csv.writer(file)
-        writer.writerow(("Name", "Template"))
-        writer.writerows(templates.items())
+                if (new := find_recent(text)) is None:
+                    new = Formatter._format_line(original, line, substitute_latex)
 
-    _saved_templates = templates
+                outputs[text] = new
+                new_lines.append(new)
 
+        if not show_steps:
+            self._recent_selections.append((settings, outputs))
 
-def _substitute_templates(match):
-    before, name = match.groups()
+        output = "\n".join(new_lines).lstrip("\n").rstrip()
 
-    if name not in _templates:
-        prefix = config.config["Formatting Controls"]["prefix"]
-        return fr"{prefix}l[{name}]"
+        # Recalling an entry on its own does not add another, so that it can be recalled again with the same number
+        if output and control != "recall":
+            self.history.add(original, output)
 
-    return before + _templates[name]
+        return output
 
+    @staticmethod
+    def _splice(text, start, end, matches, substitute):
+        # Replaces each (start, end, before, argument) match between 'start' and 'end', leaving it as it was if
+        # 'substitute' returns None
+        parts = []
+        position = start
 
-def _substitute_latex(match):
-    if type(match) is re.Match:
-        before, content, after = match.groups()
-        content = content.replace("\\$", "$")
-        content += after
-    elif type(match) is str:
-        before, content = "", match
-    else:
-        raise TypeError(f"Cannot perform latex substitution on type {type(match)}")
+        for match_start, match_end, before, argument in matches:
+            parts.append(text[position:match_start])
 
-    try:
-        parsed = latex_parser.parse(content, _context)
-    except latex_parser.Tokenizer.TokenizationError as e:
-        print(e)
-        parsed = content
-    except latex_parser.Tokenizer.BuildError as e:
-        print(e)
-        parsed = content
+            if (replacement := substitute(before, argument)) is None:
+                replacement = text[match_start:match_end]
+            parts.append(replacement)
 
-    if len(parsed.split("\n")) > 1:
-        return before + "\n" + parsed + "\n"
+            position = match_end
 
-    return parsed
+        parts.append(text[position:end])
+        return "".join(parts)
 
+    @staticmethod
+    def _get_line_mode(line):
+        # Returns where the text of the line starts, after any flag, and whether it is formatted as LaTeX as a whole
+        prefix = config.config["Formatting Controls"]["prefix"]
+        latex_by_default = int(config.config["Formatting Controls"]["latex_by_default"])
+        start = line.start + len(prefix) + 1 if line.flag is not None else line.start
 
-def reformat(original):
-    global _context
-    global _templates
-
-    _context = context_manager.get_context()
-    print(original, _context)
+        return start, line.flag == "t" or latex_by_default and line.flag != "r"
 
-    prefix = config.config["Formatting Controls"]["prefix"]
-    escaped_prefix = re.escape(prefix)
+    @staticmethod
+    def _format_text(text, start, end, spans, as_latex, substitute_latex):
+        if as_latex:
+            content = Formatter._splice(text, start, end, spans, lambda before, span: before + span)
+            return substitute_latex("", content)
 
-    latex_by_default = int(config.config["Formatting Controls"]["latex_by_default"])
-    if original == f"{prefix}lt":
-        if _templates:
-            return "All templates: " + ", ".join(name for name in _templates)
-        return "No templates"
+        return Formatter._splice(text, start, end, spans,
+                                 lambda before, span: substitute_latex(before, span.replace("\\$", "$")))
 
-    if match := re.fullmatch(fr"^{escaped_prefix}s\[([\w\d\s]+?)] ?([\w\W]+)", original):
-        name, template = match.groups()
-        _templates[name] = template
-        return ""
+    @staticmethod
+    def _format_line(text, line, substitute_latex):
+        start, as_latex = Formatter._get_line_mode(line)
+        return Formatter._format_text(text, start, line.end, line.spans, as_latex, substitute_latex)
 
-    if match := re.fullmatch(fr"^{escaped_prefix}d\[([\w\d\s]+?)]", original):
-        name = match.group(1)
+    def _format_recalls(self, text, line, substitute_latex):
+        # History entries are pasted as they were output, without being formatted again, while the text between them is
+        # formatted as usual. Recalls within a LaTeX span, or of entries which are no longer held, are left as text
+        start, as_latex = Formatter._get_line_mode(line)
+        parts = []
+        position = start
 
-        if name in _templates:
-            del _templates[name]
-            return ""
+        def format_between(end):
+            # Parsing drops the spaces around each piece of LaTeX, so those beside a recall are kept as they were
+            spans = [span for span in line.spans if position <= span[0] and span[1] <= end]
+            if not as_latex:
+                return Formatter._format_text(text, position, end, spans, False, substitute_latex)
 
-        return fr"\d[{name}]"
+            content = text[position:end]
+            if not content.strip():
+                return content
 
-    new_lines = []
-    for line in original.split("\n"):
-        line, num_replaced = re.subn(fr"(?<!\\)((?:\\\\)*){escaped_prefix}l\[([\w\d\s]+?)]", _substitute_templates,
-                                     line)
+            leading = content[:len(content) - len(content.lstrip())]
+            trailing = content[len(content.rstrip()):]
+            return leading + Formatter._format_text(text, position + len(leading), end - len(trailing), spans, True,
+                                                    substitute_latex) + trailing
 
-        if num_replaced > 0:
-            new_lines.append(line)
-            continue
+        for match_start, match_end, before, entry_num in line.history:
+            if any(span_start < match_start < span_end for span_start, span_end, _, _ in line.spans):
+                continue
 
-        if line.startswith(f"{prefix}t") or latex_by_default and not line.startswith(f"{prefix}r"):
-            if line.startswith(f"{prefix}t"):
-                content = line[len(prefix) + 1:]
-            else:
-                content = line
-
-            new = re.sub(r"(?<!\\)((?:\\\\)*)\$(.*?)(?<!\\)((?:\\\\)*)*\$", r"\1\2\3", content)
-            new = _substitute_latex(new)
-            new_lines.append(new)
-        else:
-            if line.startswith(f"{prefix}r"):
-                content = line[len(prefix) + 1:]
-            else:
-                content = line
+            if (replacement := self._substitute_history(before, entry_num)) is None:
+                continue
 
-            new = re.sub(r"(?<!\\)((?:\\\\)*)\$(.*?)(?<!\\)((?:\\\\)*)*\$", _substitute_latex, content)
-            new_lines.extend(new.split("\n"))
+            parts.append(format_between(match_start))
+            parts.append(replacement)
+            position = match_end
 
-    return "\n".join(new_lines).lstrip("\n").rstrip()
+        parts.append(format_between(line.end))
+        return "".join(parts)
 
 
 # ----- Main ----- #
-_templates = {}
-_saved_templates = {}
-
-with open("./templates.csv", newline="", encoding="utf-8") as file:
-    reader = csv.reader(file)
-    next(reader)
-
-    for name, template in reader:
-        _templates[name] = template
-        _saved_templates[name] = template
-
-t = threading.Thread(target=_template_saver)
-t.start()
+_logger = logging.getLogger(__name__)
@@ -0,0 +1,112 @@
+import mmap
+import os
+import struct
+
+_header = struct.Struct("<4sHxxIIQQ")
+_slot = struct.Struct("<QII")
+_magic = b"LHFH"
+_version = 1
+
+
+class History:
+    # Fixed size ring of recent inputs and their outputs, kept in a memory mapped file so that it survives restarts
+    # without being read into memory. The file holds a header, a ring of 'capacity' slots, and a circular log of
+    # 'data_size' bytes which entries are appended to. Each slot records where its entry starts in the log as a count of
+    # every byte ever written, so an entry is still valid as long as the log has not wrapped back over it since. Without
+    # a path, the ring is kept in anonymous memory instead
+    def __init__(self, path=None, capacity=100, data_size=1 << 20):
+        self.capacity = capacity
+        self.data_size = data_size
+
+        self._slots_start = _header.size
+        self._data_start = self._slots_start + capacity * _slot.size
+        size = self._data_start + data_size
+
+        self._file = None
+        if path is None:
+            self._map = mmap.mmap(-1, size)
+        else:
+            self._map = self._open(path, size)
+
+        magic, version, capacity, data_size, self._count, self._write_offset = _header.unpack_from(self._map, 0)
+        if (magic, version, capacity, data_size) != (_magic, _version, self.capacity, self.data_size):
+            # A new file, or one written with a different size, which is started afresh
+            self._count = self._write_offset = 0
+            self._write_header()
+
+    def _open(self, path, size):
+        mode = "r+b" if os.path.exists(path) else "w+b"
+        self._file = open(path, mode)
+
+        if os.path.getsize(path) != size:
+            self._file.truncate(size)
+
+        return mmap.mmap(self._file.fileno(), size)
+
+    def _write_header(self):
+        _header.pack_into(self._map, 0, _magic, _version, self.capacity, self.data_size, self._count,
+                          self._write_offset)
+
+    def add(self, original, output):
+        original = original.encode("utf-8")
+        output = output.encode("utf-8")
+        length = len(original) + len(output)
+
+        # Entries too large for the log are not kept
+        if length > self.data_size:
+            return
+
+        # Entries are never split across the end of the log, so skip ahead to the start if there is not enough room
+        start = self._write_offset
+        position = start % self.data_size
+        if position + length > self.data_size:
+            start += self.data_size - position
+            position = 0
+
+        # The end of the log is moved past the new entry before it is written, which invalidates every entry it is about
+        # to overwrite. The count is only raised once the entry and its slot are complete, so an interrupted write
+        # loses at most the new entry and the oldest one
+        self._write_offset = start + length
+        self._write_header()
+
+        self._map[self._data_start + position:self._data_start + position + len(original)] = original
+        position += len(original)
+        self._map[self._data_start + position:self._data_start + position + len(output)] = output
+
+        _slot.pack_into(self._map, self._slots_start + self._count % self.capacity * _slot.size, start, len(original),
+                        len(output))
+
+        self._count += 1
+        self._write_header()
+
+    def get(self, entry_num):
+        # Returns the input and output of the entry 'entry_num' entries back, where 1 is the most recent, or None if it
+        # is no longer held
+        if not 1 <= entry_num <= min(self._count, self.capacity):
+            return None
+
+        index = (self._count - entry_num) % self.capacity
+        start, original_length, output_length = _slot.unpack_from(self._map, self._slots_start + index * _slot.size)
+
+        # The log may have wrapped over the entry since, or the entry may have been interrupted before its header was
+        # written
+        if start < self._write_offset - self.data_size or start + original_length + output_length > self._write_offset:
+            return None
+
+        position = self._data_start + start % self.data_size
+        try:
+            original = self._map[position:position + original_length].decode("utf-8")
+            position += original_length
+            output = self._map[position:position + output_length].decode("utf-8")
+        except UnicodeDecodeError:
+            # A slot only partly written before an interruption
+            return None
+
+        return original, output
+
+    def close(self):
+        self._map.flush()
+        self._map.close()
+
+        if self._file is not None:
+            self._file.close()
@@ -1,8 +1,12 @@
 import collections
+import logging
 import re
 
+import cache
 import components
 import config
+import symbol_index
+import timing
 
 
 class Tokenizer:
@@ -10,6 +14,8 @@ class Tokenizer:
         pass
 
     class Token:
+        __slots__ = ()
+
         def __repr__(self):
             return "<>"
 
@@ -20,6 +26,8 @@ class Tokenizer:
             return components.Component()
 
     class BasicToken(Token):
+        __slots__ = ("text", "skip_parsing")
+
         def __init__(self, text, skip_parsing=False):
             super().__init__()
             self.text = text
@@ -35,10 +43,14 @@ class Tokenizer:
             return "<'{}'>".format(self.text)
 
     class TokenContainer(Token):
+        __slots__ = ()
+
         def apply_token_function(self, func):
             pass
 
     class TokenGroup(TokenContainer):
+        __slots__ = ("tokens",)
+
         def __init__(self, tokens):
             super().__init__()
             self.tokens = tokens
@@ -60,6 +72,8 @@ class Tokenizer:
             return "<TG [{}]>".format(", ".join(map(repr, self.tokens)))
 
     class BracketGroup(TokenGroup):
+        __slots__ = ("opening_char",)
+
         def __init__(self, opening_char, tokens):
             super().__init__(tokens)
             self.opening_char = opening_char
@@ -80,6 +94,8 @@ class Tokenizer:
             return "<BG '{}' [{}]>".format(self.opening_char, ", ".join(map(repr, self.tokens)))
 
     class ScriptGroup(TokenContainer):
+        __slots__ = ("base", "subscript", "superscript")
+
         def __init__(self, base):
             super().__init__()
             self.base = collections.deque()
@@ -119,6 +135,8 @@ class Tokenizer:
                                               ", ".join(map(repr, self.superscript)))
 
     class FunctionGroup(TokenContainer):
+        __slots__ = ("name", "component_class", "groups", "arguments")
+
         def __init__(self, name, component_class, groups, arguments):
             super().__init__()
             self.name = name
@@ -148,136 +166,145 @@ class Tokenizer:
 
     @staticmethod
     def tokenize(source, show_steps=False):
-        def show_step(*args):
-            if show_steps:
-                print(*args)
-
-        show_step(0, source)
-        tokens = Tokenizer._partially_tokenize(source)
-        show_step(1, tokens)
-        tokens = Tokenizer._group_tokens(tokens)
-        show_step(2, tokens)
-        tokens = Tokenizer._parse_scripts(tokens)
-        show_step(3, tokens)
-        tokens = Tokenizer._parse_functions(tokens)
-        show_step(4, tokens)
-        tokens = Tokenizer._parse_shortcuts(tokens)
-        show_step(5, tokens)
-        tokens = Tokenizer._add_spacing(tokens)
-        show_step(6, tokens)
-        tokens = Tokenizer._compress_tokens(tokens)
-        show_step(7, tokens)
-        token_group = Tokenizer.TokenGroup(tokens)
-        show_step(8, token_group)
+        trace = timing.begin_trace() if show_steps else None
+
+        try:
+            timing.note("source", source)
+
+            start_time = timing.start()
+            tokens = Tokenizer._lex(source)
+            timing.stop("tokenize.lex", start_time, tokens)
+
+            start_time = timing.start()
+            tokens = Tokenizer._parse(tokens, Tokenizer._ALL_PASSES, {})
+            token_group = Tokenizer.TokenGroup(tokens)
+            timing.stop("tokenize.parse", start_time, token_group)
+
+        finally:
+            timing.end_trace(trace)
+
         return token_group
 
-    @staticmethod
-    def _partially_tokenize(source):
-        # source = re.sub(r"[]", "", source)
-        # ([\\(){}\[\]|+\-*×÷^_]|[a-zA-Z]+|\d[a-zA-Z\d]*)
-        # ([a-zA-Z]+|\d[a-zA-Z\d]*|.)
-        tokens = re.split(r"([a-zA-Z]+|\d+|.)", source)
-        tokens = filter(lambda x: x.replace(" ", ""), tokens)
-        tokens = (Tokenizer.BasicToken(token) for token in tokens)
-        return collections.deque(tokens)
+    _lexeme_pattern = re.compile(r"[a-zA-Z]+|\d+|\n+|[^ ]")
+    _bracket_pairs = {"{": "}", "(": ")", "[": "]", "|": "|"}
 
     @staticmethod
-    def _group_tokens(tokens):
-        pairs = {"{": "}", "(": ")", "[": "]", "|": "|"}
-
-        depth = 0
-        group_flag = False
-        opening, closing = None, None
+    def _lex(source):
+        # Each frame on the stack is (opening char, closing char, enclosing tokens). An opening char of None denotes a
+        # plain {...} group rather than a bracket group
+        tokens = collections.deque()
+        stack = []
         escape_state = None
 
-        grouped_tokens = collections.deque()
-        dump = []
+        for match in Tokenizer._lexeme_pattern.finditer(source):
+            token_text = match.group()
 
-        for basic_token in tokens:
-            token_text = basic_token.text
+            if token_text == "\\":
+                if escape_state is None:
+                    escape_state = "\\"
+                    continue
 
-            if escape_state is None and token_text == "\\":
-                escape_state = "\\"
-                continue
+                if escape_state == "\\":
+                    tokens.append(Tokenizer.BasicToken("\\\\"))
+                    escape_state = None
+                    continue
 
-            if (escape_state == "left" or escape_state == "right") and token_text == "\\":
+                # Backslash between '\left' or '\right' and its bracket
                 continue
 
             if escape_state == "\\" and (token_text == "left" or token_text == "right"):
-                escape_state = basic_token.text
+                escape_state = token_text
                 continue
 
-            if escape_state == "\\" and token_text == "\\":
-                dump.append(Tokenizer.BasicToken("\\\\"))
-                escape_state = None
-                continue
+            # Escaped brackets such as '\{' are plain text, and never open or close a group
+            escaped = escape_state == "\\"
+
+            if stack and not escaped:
+                opening, closing, _ = stack[-1]
+
+                if token_text == closing and (escape_state is None if opening is None else
+                                              opening != closing or escape_state != "left"):
+                    if opening is None:
+                        group = Tokenizer.TokenGroup(tokens)
+                    else:
+                        group = Tokenizer.BracketGroup(opening, tokens)
+
+                    tokens = stack.pop()[2]
+                    tokens.append(group)
+                    escape_state = None
+                    continue
 
-            if not group_flag and opening is None and token_text == "{" and escape_state is None:
-                grouped_tokens.extend(dump)
-                dump = []
-                group_flag = True
-                depth = 1
+            if token_text == "{" and escape_state is None:
+                stack.append((None, "}", tokens))
+                tokens = collections.deque()
                 continue
 
-            if not group_flag and opening is None and token_text in pairs:
-                grouped_tokens.extend(dump)
-                dump = []
-                opening = token_text
-                closing = pairs[opening]
-                depth = 1
+            if token_text in Tokenizer._bracket_pairs and not escaped:
+                stack.append((token_text, Tokenizer._bracket_pairs[token_text], tokens))
+                tokens = collections.deque()
                 escape_state = None
                 continue
 
-            if group_flag and token_text == "{" and escape_state is None:
-                depth += 1
-            elif group_flag and token_text == "}" and escape_state is None:
-                depth -= 1
-
-            elif token_text == opening == closing:
-                if escape_state == "left":
-                    depth += 1
-                elif escape_state == "right":
-                    depth -= 1
-                elif depth == 0:
-                    depth += 1
-                else:
-                    depth -= 1
-
-            elif token_text == opening:
-                depth += 1
-            elif token_text == closing:
-                depth -= 1
-
-            if group_flag and depth == 0:
-                grouped_tokens.append(Tokenizer.TokenGroup(Tokenizer._group_tokens(dump)))
-                group_flag = False
-                dump = []
-            elif token_text == closing and depth == 0:
-                grouped_tokens.append(Tokenizer.BracketGroup(opening, Tokenizer._group_tokens(dump)))
-                opening = None
-                closing = None
-                dump = []
-            elif escape_state == "\\":
-                dump.append(Tokenizer.BasicToken(Tokenizer._replace_symbol("\\" + token_text)))
-            elif escape_state == "left" or escape_state == "right":
-                dump.append(Tokenizer.BasicToken("\\" + escape_state))
-                dump.append(basic_token)
+            if escape_state == "\\":
+                tokens.append(Tokenizer.BasicToken(Tokenizer._replace_symbol("\\" + token_text)))
+            elif escape_state is not None:
+                tokens.append(Tokenizer.BasicToken("\\" + escape_state))
+                tokens.append(Tokenizer.BasicToken(token_text))
             else:
-                dump.append(basic_token)
+                tokens.append(Tokenizer.BasicToken(token_text))
 
             escape_state = None
 
-        if depth != 0:
+        if stack:
             raise Tokenizer.TokenizationError("Imbalanced Brackets")
 
         if escape_state is not None:
-            print("Warn: Trailing '\\, '\\left' or '\\right' within group")
+            _logger.info("Trailing '\\, '\\left' or '\\right' within group")
+
+        return tokens
+
+    _SCRIPTS = 1
+    _FUNCTIONS = 2
+    _SHORTCUTS = 4
+    _ALL_PASSES = _SCRIPTS | _FUNCTIONS | _SHORTCUTS
 
-        grouped_tokens.extend(dump)
-        return grouped_tokens
+    @staticmethod
+    def _parse(tokens, passes, restricted, local_passes=None):
+        # Runs every parsing stage over a single list of tokens, then descends into each container exactly once.
+        # 'restricted' maps the id of a container to the stages its contents should receive when that differs from
+        # 'passes', which keeps results identical to running each stage over the whole tree in turn
+        if local_passes is None:
+            local_passes = passes
+
+        if local_passes & Tokenizer._SCRIPTS:
+            tokens = Tokenizer._parse_scripts(tokens, passes, restricted)
+        if local_passes & Tokenizer._FUNCTIONS:
+            tokens = Tokenizer._parse_functions(tokens)
+        if local_passes & Tokenizer._SHORTCUTS:
+            tokens = Tokenizer._parse_shortcuts(tokens, passes, restricted)
+
+        for token in tokens:
+            if isinstance(token, Tokenizer.TokenContainer):
+                Tokenizer._parse_container(token, restricted.get(id(token), passes), restricted)
+
+        tokens = Tokenizer._add_spacing(tokens)
+        return Tokenizer._compress_tokens(tokens)
+
+    @staticmethod
+    def _parse_container(token, passes, restricted):
+        if type(token) is Tokenizer.ScriptGroup:
+            # Base and script deques are created after script parsing, so only their contents are script parsed
+            local_passes = passes & ~Tokenizer._SCRIPTS
+            token.apply_token_function(lambda tokens: Tokenizer._parse(tokens, passes, restricted, local_passes))
+        elif type(token) is Tokenizer.FunctionGroup:
+            for group in token.groups:
+                Tokenizer._parse_container(group, restricted.get(id(group), passes), restricted)
+        else:
+            token.apply_token_function(lambda tokens: Tokenizer._parse(tokens, passes, restricted))
 
     @staticmethod
     def _replace_symbol(token_text):
+        symbols = symbol_index.load().symbols
         if token_text.startswith("\\") and (key := token_text[1:]) in symbols:
             return symbols[key]
         return token_text
@@ -301,14 +328,13 @@ class Tokenizer:
         return tokens, fetched
 
     @staticmethod
-    def _parse_scripts(tokens):
+    def _parse_scripts(tokens, passes, restricted):
         parsed_tokens = collections.deque()
 
         while len(tokens) > 0:
             token = tokens.popleft()
 
             if isinstance(token, Tokenizer.TokenContainer):
-                token.apply_token_function(Tokenizer._parse_scripts)
                 parsed_tokens.append(token)
                 continue
 
@@ -328,6 +354,7 @@ class Tokenizer:
                 if type(base) is Tokenizer.ScriptGroup:
                     if script_flag == 1 and len(base.subscript) == 0 or script_flag == 2 and len(base.superscript) == 0:
                         tokens, (script,) = Tokenizer._fetch_tokens(tokens, ("",))
+                        restricted[id(script)] = passes & ~Tokenizer._SCRIPTS
 
                         if script_flag == 1:
                             base.subscript.append(script)
@@ -344,13 +371,11 @@ class Tokenizer:
                 tokens, (script,) = Tokenizer._fetch_tokens(tokens, ("",))
                 group = Tokenizer.ScriptGroup(base)
 
-                if isinstance(script, Tokenizer.TokenGroup):
-                    script.apply_token_function(Tokenizer._parse_scripts)
-
-                elif script_flag == 1 and script.text == "_":
-                    raise Tokenizer.TokenizationError("Multiple subscripts found inline")
-                elif script_flag == 2 and script.text == "^":
-                    raise Tokenizer.TokenizationError("Multiple superscripts found inline")
+                if not isinstance(script, Tokenizer.TokenGroup):
+                    if script_flag == 1 and script.text == "_":
+                        raise Tokenizer.TokenizationError("Multiple subscripts found inline")
+                    elif script_flag == 2 and script.text == "^":
+                        raise Tokenizer.TokenizationError("Multiple superscripts found inline")
 
                 if script_flag == 1:
                     group.subscript.append(script)
@@ -366,13 +391,13 @@ class Tokenizer:
 
     @staticmethod
     def _parse_functions(tokens):
+        simple_functions = symbol_index.load().simple_functions
         parsed_tokens = collections.deque()
 
         while len(tokens) > 0:
             token = tokens.popleft()
 
             if isinstance(token, Tokenizer.TokenContainer):
-                token.apply_token_function(Tokenizer._parse_functions)
                 parsed_tokens.append(token)
                 continue
 
@@ -390,23 +415,23 @@ class Tokenizer:
             if name in simple_functions:
                 next_token = tokens[0]
                 if type(next_token) is not Tokenizer.TokenGroup:
-                    print("Encountered simple function '{}' but no following group. Treating as text".format(name))
+                    _logger.info("Encountered simple function '%s' but no following group. Treating as text", name)
                     token.text = name
                     token.skip_parsing = True
                     parsed_tokens.append(token)
                     continue
 
                 if len(next_token.tokens) != 1 or type(contents := next_token.tokens[0]) is not Tokenizer.BasicToken:
-                    print("Encountered simple function '{}' but following group was not valid. Treating as text"
-                          .format(name))
+                    _logger.info("Encountered simple function '%s' but following group was not valid. Treating as text",
+                                 name)
                     token.text = name
                     token.skip_parsing = True
                     parsed_tokens.append(token)
                     continue
 
                 if contents.text not in simple_functions[name]:
-                    print("The simple function '{}' has no defined output for the input '{}'. Treating as text"
-                          .format(name, contents.text))
+                    _logger.info("The simple function '%s' has no defined output for the input '%s'. Treating as text",
+                                 name, contents.text)
                     token.text = name
                     token.skip_parsing = True
                     parsed_tokens.append(token)
@@ -420,7 +445,7 @@ class Tokenizer:
                 continue
 
             elif name not in components.function_components:
-                print("Encountered unknown function '{}'. Treating as text".format(name))
+                _logger.info("Encountered unknown function '%s'. Treating as text", name)
                 token.text = name
                 token.skip_parsing = True
                 parsed_tokens.append(token)
@@ -428,8 +453,6 @@ class Tokenizer:
 
             component_class, num_groups, arguments = components.function_components[name]
             tokens, groups = tuple(Tokenizer._fetch_tokens(tokens, tuple("T-TC-TG" for _ in range(num_groups))))
-            for group in groups:
-                group.apply_token_function(Tokenizer._parse_functions)
 
             function_group = Tokenizer.FunctionGroup(name, component_class, groups, arguments)
             parsed_tokens.append(function_group)
@@ -437,7 +460,7 @@ class Tokenizer:
         return parsed_tokens
 
     @staticmethod
-    def _parse_shortcuts(tokens):
+    def _parse_shortcuts(tokens, passes, restricted):
         parsed_tokens = collections.deque()
         allow_fraction_shortcut = int(config.config["Parser"]["allow_fraction_shortcut"])
 
@@ -447,7 +470,6 @@ class Tokenizer:
             token = tokens.popleft()
 
             if isinstance(token, Tokenizer.TokenContainer):
-                token.apply_token_function(Tokenizer._parse_shortcuts)
                 parsed_tokens.append(token)
                 continue
 
@@ -463,15 +485,21 @@ class Tokenizer:
                 top = parsed_tokens.pop()
                 bottom = tokens.popleft()
 
+                # Tokens wrapped into new groups have already been parsed, and the bottom of a shortcut fraction
+                # is not searched for further shortcuts
                 if type(top) is Tokenizer.BasicToken:
                     top_tokens = collections.deque()
                     top_tokens.append(top)
                     top = Tokenizer.TokenGroup(top_tokens)
+                    restricted[id(top)] = 0
 
                 if type(bottom) is Tokenizer.BasicToken:
                     bottom_tokens = collections.deque()
                     bottom_tokens.append(bottom)
                     bottom = Tokenizer.TokenGroup(bottom_tokens)
+                    restricted[id(bottom)] = 0
+                else:
+                    restricted[id(bottom)] = passes & ~Tokenizer._SHORTCUTS
 
                 function_group = Tokenizer.FunctionGroup("frac", fraction_class, (top, bottom), fraction_arguments)
                 parsed_tokens.append(function_group)
@@ -486,14 +514,13 @@ class Tokenizer:
         if len(tokens) == 0:
             return collections.deque()
 
+        index = symbol_index.load()
+        non_spaced_chars = index.non_spaced_chars
+        equality_operator_chars = index.equality_operator_chars
+        unary_operator_chars = index.unary_operator_chars
         formatted_tokens = collections.deque()
 
-        if len(tokens) == 1 and isinstance(tokens[0], Tokenizer.TokenContainer):
-            token = tokens.popleft()
-            token.apply_token_function(Tokenizer._add_spacing)
-            formatted_tokens.append(token)
-            return formatted_tokens
-        elif len(tokens) == 1:
+        if len(tokens) == 1:
             formatted_tokens.append(tokens.popleft())
             return formatted_tokens
 
@@ -505,7 +532,6 @@ class Tokenizer:
             token = tokens.popleft()
 
             if isinstance(last_token, Tokenizer.TokenContainer):
-                last_token.apply_token_function(Tokenizer._add_spacing)
                 formatted_tokens.append(last_token)
 
                 if type(last_token) is Tokenizer.ScriptGroup and type(token) is Tokenizer.ScriptGroup \
@@ -518,7 +544,6 @@ class Tokenizer:
             if type(last_token) is Tokenizer.BasicToken and last_token.skip_parsing:
                 formatted_tokens.append(last_token)
                 formatted_tokens.append(Tokenizer.BasicToken(" "))
-                print("a")
                 continue
 
             if type(last_token) is not Tokenizer.BasicToken or type(token) is not Tokenizer.BasicToken:
@@ -543,9 +568,6 @@ class Tokenizer:
                     or any(char not in non_spaced_chars for char in token.text):
                 formatted_tokens.append(Tokenizer.BasicToken(" "))
 
-        if isinstance(token, Tokenizer.TokenContainer):
-            token.apply_token_function(Tokenizer._add_spacing)
-
         formatted_tokens.append(token)
         return formatted_tokens
 
@@ -561,9 +583,6 @@ class Tokenizer:
                     compressed_tokens.append(Tokenizer.BasicToken(text))
                     buffer = []
 
-                if isinstance(token, Tokenizer.TokenContainer):
-                    token.apply_token_function(Tokenizer._compress_tokens)
-
                 compressed_tokens.append(token)
                 continue
 
@@ -576,38 +595,186 @@ class Tokenizer:
         return compressed_tokens
 
 
+_structure_chars = frozenset("\n{}()[]|_^")
+
+
+def _format_plain(text, allow_fraction_shortcut):
+    # Formats input made up only of text, symbols and simple functions straight from its lexemes, returning None if
+    # it contains anything else. Such input always tokenizes to a single line of text, so it can skip building a
+    # layout. The lexing, function and spacing rules followed here must match those of the tokenizer
+    index = symbol_index.load()
+    symbols, simple_functions = index.symbols, index.simple_functions
+    non_spaced_chars = index.non_spaced_chars
+    equality_operator_chars, unary_operator_chars = index.equality_operator_chars, index.unary_operator_chars
+    lexemes = Tokenizer._lexeme_pattern.findall(text)
+    tokens = []
+
+    def get_symbol(name):
+        if name[0] in _structure_chars or name in ("\\", "left", "right") or name not in symbols:
+            return None
+        value = symbols[name]
+        if value.startswith("\\") or value in ("_", "^") or allow_fraction_shortcut and value == "/":
+            return None
+        return value
+
+    i = 0
+    while i < len(lexemes):
+        lexeme = lexemes[i]
+        i += 1
+
+        if lexeme[0] in _structure_chars or allow_fraction_shortcut and lexeme == "/":
+            return None
+
+        if lexeme != "\\":
+            tokens.append((lexeme, False))
+            continue
+
+        if i == len(lexemes):
+            return None
+
+        name = lexemes[i]
+        i += 1
+
+        if (value := get_symbol(name)) is not None:
+            tokens.append((value, False))
+            continue
+
+        if name not in simple_functions or name in symbols or i == len(lexemes) or lexemes[i] != "{":
+            return None
+
+        # Simple functions take a group containing a single text or symbol token
+        argument = lexemes[i + 1:i + 4]
+        if len(argument) >= 3 and argument[0] == "\\" and argument[2] == "}":
+            function_input = get_symbol(argument[1])
+            i += 4
+        elif len(argument) >= 2 and argument[0] != "\\" and argument[0][0] not in _structure_chars \
+                and argument[1] == "}":
+            function_input = argument[0]
+            i += 3
+        else:
+            return None
+
+        outputs = simple_functions[name]
+        if function_input is None or function_input not in outputs:
+            return None
+
+        tokens.append((outputs[function_input], True))
+
+    parts = []
+    unary_flag = False
+
+    for (last_text, last_skip_parsing), (text, _) in zip(tokens, tokens[1:]):
+        parts.append(last_text)
+
+        if last_skip_parsing:
+            parts.append(" ")
+        elif unary_flag:
+            unary_flag = False
+        elif last_text in equality_operator_chars and text in unary_operator_chars:
+            unary_flag = True
+            parts.append(" ")
+        elif any(char not in non_spaced_chars for char in last_text) \
+                or any(char not in non_spaced_chars for char in text):
+            parts.append(" ")
+
+    if tokens:
+        parts.append(tokens[-1][0])
+
+    return "".join(parts).rstrip(" ")
+
+
 def parse(text, context):
     show_steps = bool(int(config.config["Parser"]["show_steps"]))
-    token = Tokenizer.tokenize(text, show_steps)
-    return token.get_component().render(context)
+    trace = timing.begin_trace() if show_steps else None
+
+    try:
+        start_time = timing.start()
+        rendered = _parse(text, context, show_steps)
+        timing.stop("parse", start_time, rendered)
+
+    finally:
+        timing.end_trace(trace)
+
+    return rendered
+
+
+def _parse(text, context, show_steps):
+    # Plain text and symbols do not need a layout, and give the same result in every context
+    if not show_steps and (plain := _format_plain(text, int(config.config["Parser"]["allow_fraction_shortcut"]))) \
+            is not None:
+        return plain
+
+    # Parsed trees do not depend on the context, so switching windows only requires the layout to be redone
+    parse_key = _get_parse_key(text)
+    render_key = (parse_key, context.font_info, context.tabsize, config.config["Misc"]["rounding_function"])
+
+    if (pinned := _pinned.get(parse_key)) is not None:
+        _, component, renders = pinned
+
+        if (rendered := renders.get(render_key)) is None:
+            rendered = component.render(context)
+            renders.put(render_key, rendered)
+        return rendered
+
+    if (rendered := _render_cache.get(render_key)) is not None:
+        return rendered
+
+    if (component := _parse_cache.get(parse_key)) is None:
+        component = _get_component(text, show_steps)
+        _parse_cache.put(parse_key, component)
+
+    rendered = component.render(context)
+    _render_cache.put(render_key, rendered)
+    return rendered
+
+
+def _get_parse_key(text):
+    # Parsed trees depend on the symbol tables they were built with as well as the text
+    return text, config.config["Parser"]["allow_fraction_shortcut"], config.config["Misc"]["symbol_index"]
+
+
+def _get_component(text, show_steps):
+    token_group = Tokenizer.tokenize(text, show_steps)
+
+    start_time = timing.start()
+    component = token_group.get_component()
+    timing.stop("get_component", start_time)
+    return component
+
+
+def pin(text):
+    # Keeps the parsed form of an expression, along with its output in the last few contexts, until it is unpinned,
+    # rather than leaving it to be evicted from the caches. Pins are counted, so each successful call must be matched by
+    # a call to unpin. Returns False, without pinning, for plain text, which is formatted without being parsed
+    if _format_plain(text, int(config.config["Parser"]["allow_fraction_shortcut"])) is not None:
+        return False
+
+    parse_key = _get_parse_key(text)
+
+    if (pinned := _pinned.get(parse_key)) is not None:
+        pinned[0] += 1
+        return True
+
+    if (component := _parse_cache.get(parse_key)) is None:
+        component = _get_component(text, False)
+
+    # Outputs are keyed by font, so only a few are kept to avoid holding on to every font the expression was used with
+    _pinned[parse_key] = [1, component, cache.LRUCache(int(config.config["Misc"]["pinned_render_cache_size"]))]
+    return True
+
+
+def unpin(text):
+    parse_key = _get_parse_key(text)
+
+    if (pinned := _pinned.get(parse_key)) is not None:
+        pinned[0] -= 1
+        if pinned[0] <= 0:
+            del _pinned[parse_key]
 
 
 # ----- Main ----- #
-symbols = {}
-
-with open("symbols/symbols.txt", encoding="utf-8") as file:
-    for line in file.readlines():
-        if line.strip() and not line.strip().startswith("#"):
-            x, y = line.strip().split(" ")
-            symbols[x] = y
-
-with open("symbols/spacing_chars.txt", encoding="utf-8") as file:
-    non_spaced_chars = set(file.readline().strip())
-    equality_operator_chars = set(file.readline().strip())
-    unary_operator_chars = set(file.readline().strip())
-
-variable_chars = {}
-with open("symbols/variables.txt", encoding="utf-8") as file:
-    for line in file.readlines():
-        if line.strip() and not line.strip().startswith("#"):
-            x, y = line.strip().split(" ")
-            variable_chars[x] = y
-
-simple_functions = {}
-with open("symbols/simple_functions.txt", encoding="utf-8") as file:
-    for line in file.readlines():
-        if line.strip() and not line.strip().startswith("#"):
-            x, y, z = line.strip().split(" ")
-            if x not in simple_functions:
-                simple_functions[x] = {}
-            simple_functions[x][y] = z
+_logger = logging.getLogger(__name__)
+
+_parse_cache = cache.LRUCache(int(config.config["Misc"]["parse_cache_size"]))
+_render_cache = cache.LRUCache(int(config.config["Misc"]["render_cache_size"]))
+_pinned = {}
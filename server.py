@@ -0,0 +1,133 @@
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+import socket
+import sys
+
+import client
+import config
+import context_manager
+import formatter
+import history
+
+
+class FormattingServer:
+    # Templates are shared between clients, and only kept in memory unless a path is given. Each client has its own
+    # history, so that one client can never recall another's text
+    def __init__(self, templates_path=None):
+        self.text_formatter = formatter.Formatter(templates_path)
+        self.history = self.text_formatter.history
+
+        # The parser's caches are not thread safe, so requests are formatted one at a time, away from the event loop so
+        # that other clients can still be read from and written to
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    @staticmethod
+    def _get_context(request):
+        if "font" in request:
+            return context_manager.get_font_context(request["font"], request.get("tabsize"))
+        if "executable" in request:
+            return context_manager.get_context((request["executable"], request.get("window_title", "")))
+        return context_manager.default_context
+
+    def format(self, request, client_history=None):
+        context = self._get_context(request)
+        self.text_formatter.history = self.history if client_history is None else client_history
+        return self.text_formatter.reformat(request["text"], context)
+
+    async def handle_client(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        client_history = history.History(None, int(config.config["Misc"]["history_size"]),
+                                         int(config.config["Misc"]["history_buffer_size"]))
+
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    output = await loop.run_in_executor(self.executor, self.format, request, client_history)
+                    response = {"output": output}
+                except (ValueError, KeyError, TypeError) as e:
+                    response = {"error": f"Invalid request: {e!r}"}
+                except Exception as e:
+                    response = {"error": f"Could not format text: {e!r}"}
+
+                writer.write(json.dumps(response).encode("utf-8") + b"\n")
+                await writer.drain()
+
+        except (ConnectionError, ValueError):
+            # Dropped connections, or requests longer than the stream limit
+            pass
+
+        finally:
+            writer.close()
+
+            # Requests are formatted one at a time, so this waits for any request still using the history to finish
+            await loop.run_in_executor(self.executor, client_history.close)
+
+    async def serve(self, address):
+        if type(address) is str:
+            if os.path.exists(address):
+                # A socket left behind by a server which has stopped is replaced, but one still in use is not
+                with socket.socket(socket.AF_UNIX) as probe:
+                    try:
+                        probe.connect(address)
+                    except ConnectionRefusedError:
+                        os.remove(address)
+                    else:
+                        raise OSError(f"Another server is already listening on {address}")
+
+            server = await asyncio.start_unix_server(self.handle_client, address, limit=client.STREAM_LIMIT)
+        else:
+            server = await asyncio.start_server(self.handle_client, *address, limit=client.STREAM_LIMIT)
+
+        print(f"Listening on {address}")
+
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown()
+        self.text_formatter.history = self.history
+        self.text_formatter.close()
+
+
+# ----- Main ----- #
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve formatting requests from other processes, keeping fonts, "
+                                                 "symbol tables and caches loaded.")
+    parser.add_argument("-s", "--socket", help="path of the Unix domain socket to listen on")
+    parser.add_argument("-p", "--port", type=int, help="localhost port to listen on instead of a Unix domain socket")
+    parser.add_argument("-t", "--templates", help="CSV file to load templates from and save them to, instead of only "
+                                                  "keeping them in memory")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print parser messages to standard error")
+    args = parser.parse_args()
+
+    if args.port is not None:
+        address = ("127.0.0.1", args.port)
+    elif args.socket is not None:
+        address = args.socket
+    else:
+        address = client.get_address()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    formatting_server = FormattingServer(args.templates)
+
+    # Load every font and warm up the parser before accepting requests
+    for c in (context_manager.default_context, *context_manager.contexts):
+        _ = c.font_info
+    formatting_server.format({"text": r"\frac{a}{b}"})
+
+    try:
+        asyncio.run(formatting_server.serve(address))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(f"Could not start server: {e}")
+        sys.exit(1)
+    finally:
+        formatting_server.close()
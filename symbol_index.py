@@ -0,0 +1,319 @@
+import collections.abc
+import functools
+import hashlib
+import mmap
+import os
+import struct
+
+import config
+
+_header = struct.Struct("<4sHH")
+_source_header = struct.Struct("<qq20sH")
+_table_header = struct.Struct("<HI")
+_magic = b"LHFS"
+_version = 1
+_lookup_cache_size = int(config.config["Misc"]["symbol_cache_size"])
+
+_sources = {
+    "symbols": config.get_path("symbols/symbols.txt"),
+    "simple_functions": config.get_path("symbols/simple_functions.txt"),
+    "variables": config.get_path("symbols/variables.txt"),
+    "spacing_chars": config.get_path("symbols/spacing_chars.txt"),
+    "subscript": config.get_path("symbols/subscript.txt"),
+    "superscript": config.get_path("symbols/superscript.txt")
+}
+
+
+class SymbolTable(collections.abc.Mapping):
+    # Read only string to string mapping stored as sorted UTF-8 keys and values with offset arrays, looked up by
+    # binary search directly in the mapped file
+    def __init__(self, buffer, offset):
+        view = memoryview(buffer)
+        (self._length,) = struct.unpack_from("<I", buffer, offset)
+
+        offsets_size = (self._length + 1) * 4
+        offset += 4
+        self._key_offsets = view[offset:offset + offsets_size].cast("I")
+        offset += offsets_size
+        self._value_offsets = view[offset:offset + offsets_size].cast("I")
+        offset += offsets_size
+
+        self._buffer = buffer
+        self._keys_start = offset
+        self._values_start = offset + self._key_offsets[self._length]
+
+        # The same few symbols are looked up repeatedly, so recent results are kept, including keys which were not found
+        self._lookup = functools.lru_cache(maxsize=_lookup_cache_size)(self._find_value)
+
+    def _get_key(self, index):
+        return self._buffer[self._keys_start + self._key_offsets[index]:self._keys_start + self._key_offsets[index + 1]]
+
+    def _get_value(self, index):
+        start = self._values_start + self._value_offsets[index]
+        end = self._values_start + self._value_offsets[index + 1]
+        return self._buffer[start:end].decode("utf-8")
+
+    def _find(self, key):
+        encoded = key.encode("utf-8")
+        low, high = 0, self._length
+
+        while low < high:
+            mid = (low + high) // 2
+            if self._get_key(mid) < encoded:
+                low = mid + 1
+            else:
+                high = mid
+
+        if low < self._length and self._get_key(low) == encoded:
+            return low
+        return -1
+
+    def _find_value(self, key):
+        index = self._find(key)
+        return self._get_value(index) if index >= 0 else None
+
+    def __getitem__(self, key):
+        if (value := self._lookup(key)) is None:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        return (self._get_key(index).decode("utf-8") for index in range(self._length))
+
+    def __len__(self):
+        return self._length
+
+
+class SimpleFunctionTable(collections.abc.Mapping):
+    # Maps function names to their inputs and outputs. Entries are stored with keys of the form 'name input'
+    def __init__(self, names, outputs):
+        self._names = names
+        self._outputs = outputs
+
+    def __getitem__(self, name):
+        if name not in self._names:
+            raise KeyError(name)
+        return SimpleFunctionInputs(self._outputs, name)
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+
+class SimpleFunctionInputs(collections.abc.Mapping):
+    def __init__(self, outputs, name):
+        self._outputs = outputs
+        self._prefix = name + " "
+
+    def __getitem__(self, function_input):
+        return self._outputs[self._prefix + function_input]
+
+    def __iter__(self):
+        return (key[len(self._prefix):] for key in self._outputs if key.startswith(self._prefix))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class SymbolIndex:
+    def __init__(self, symbols, simple_functions, variable_chars, subscript_chars, superscript_chars, spacing_chars):
+        self.symbols = symbols
+        self.simple_functions = simple_functions
+        self.variable_chars = variable_chars
+        self.subscript_chars = subscript_chars
+        self.superscript_chars = superscript_chars
+
+        self.non_spaced_chars = set(spacing_chars["non_spaced"])
+        self.equality_operator_chars = set(spacing_chars["equality_operator"])
+        self.unary_operator_chars = set(spacing_chars["unary_operator"])
+
+    @staticmethod
+    def from_tables(tables):
+        simple_functions = {}
+        for key, output in tables["simple_functions"].items():
+            name, function_input = key.split(" ")
+            simple_functions.setdefault(name, {})[function_input] = output
+
+        return SymbolIndex(tables["symbols"], simple_functions, tables["variables"], tables["subscript"],
+                           tables["superscript"], tables["spacing_chars"])
+
+    @staticmethod
+    def from_buffer(buffer, offset):
+        (num_tables,) = struct.unpack_from("<H", buffer, offset)
+        offset += 2
+
+        tables = {}
+        for _ in range(num_tables):
+            name_length, table_offset = _table_header.unpack_from(buffer, offset)
+            offset += _table_header.size
+            name = bytes(buffer[offset:offset + name_length]).decode("utf-8")
+            offset += name_length
+            tables[name] = SymbolTable(buffer, table_offset)
+
+        simple_functions = SimpleFunctionTable(tables["simple_function_names"], tables["simple_functions"])
+        return SymbolIndex(tables["symbols"], simple_functions, tables["variables"], tables["subscript"],
+                           tables["superscript"], tables["spacing_chars"])
+
+
+def _get_source_stats():
+    stats = {}
+    for name, path in _sources.items():
+        stat = os.stat(path)
+        stats[name] = (stat.st_mtime_ns, stat.st_size)
+    return stats
+
+
+def _get_source_hash(path):
+    with open(path, "rb") as file:
+        return hashlib.sha1(file.read()).digest()
+
+
+def _read_pairs(path, num_values, skip_comments=True):
+    with open(path, encoding="utf-8") as file:
+        for line in file.readlines():
+            if skip_comments and (not line.strip() or line.strip().startswith("#")):
+                continue
+
+            values = line.strip().split(" ")
+            if len(values) != num_values:
+                raise ValueError(f"Expected {num_values} values in '{path}', found '{line.strip()}'")
+            yield values
+
+
+def read_tables():
+    tables = {
+        "symbols": {x: y for x, y in _read_pairs(_sources["symbols"], 2)},
+        "simple_functions": {f"{x} {y}": z for x, y, z in _read_pairs(_sources["simple_functions"], 3)},
+        "variables": {x: y for x, y in _read_pairs(_sources["variables"], 2)},
+        "subscript": {x: y for x, y in _read_pairs(_sources["subscript"], 2, skip_comments=False)},
+        "superscript": {x: y for x, y in _read_pairs(_sources["superscript"], 2, skip_comments=False)}
+    }
+
+    with open(_sources["spacing_chars"], encoding="utf-8") as file:
+        tables["spacing_chars"] = {
+            "non_spaced": file.readline().strip(),
+            "equality_operator": file.readline().strip(),
+            "unary_operator": file.readline().strip()
+        }
+
+    tables["simple_function_names"] = {key.split(" ")[0]: "" for key in tables["simple_functions"]}
+    return tables
+
+
+def _pack_table(table):
+    items = sorted((key.encode("utf-8"), value.encode("utf-8")) for key, value in table.items())
+
+    key_offsets, value_offsets = [0], [0]
+    for key, value in items:
+        key_offsets.append(key_offsets[-1] + len(key))
+        value_offsets.append(value_offsets[-1] + len(value))
+
+    packed = struct.pack(f"<I{len(key_offsets)}I{len(value_offsets)}I", len(items), *key_offsets, *value_offsets)
+    packed += b"".join(key for key, _ in items) + b"".join(value for _, value in items)
+    return packed + b"\0" * (-len(packed) % 4)
+
+
+def build(path):
+    stats = _get_source_stats()
+    tables = read_tables()
+
+    header = bytearray(_header.pack(_magic, _version, len(_sources)))
+    for name, path_name in _sources.items():
+        encoded = name.encode("utf-8")
+        header += _source_header.pack(*stats[name], _get_source_hash(path_name), len(encoded)) + encoded
+
+    directory_size = 2 + sum(_table_header.size + len(name.encode("utf-8")) for name in tables)
+    offset = len(header) + directory_size
+    offset += -offset % 4
+
+    directory = bytearray(struct.pack("<H", len(tables)))
+    packed_tables = []
+    for name, table in tables.items():
+        packed = _pack_table(table)
+        encoded = name.encode("utf-8")
+        directory += _table_header.pack(len(encoded), offset) + encoded
+        packed_tables.append(packed)
+        offset += len(packed)
+
+    data = header + directory
+    data += b"\0" * (-len(data) % 4)
+
+    directory_name = os.path.dirname(path)
+    if directory_name:
+        os.makedirs(directory_name, exist_ok=True)
+
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as file:
+        file.write(data)
+        for packed in packed_tables:
+            file.write(packed)
+    os.replace(temp_path, path)
+
+    return tables
+
+
+def _open_index(path):
+    # Returns the mapped file and the offset of the table directory, or None if the index is missing or outdated
+    try:
+        file = open(path, "rb")
+    except OSError:
+        return None
+
+    try:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        file.close()
+        return None
+    file.close()
+
+    try:
+        magic, version, num_sources = _header.unpack_from(buffer)
+        if magic != _magic or version != _version or num_sources != len(_sources):
+            raise ValueError("Symbol index has an unknown format")
+
+        offset = _header.size
+        stats = _get_source_stats()
+        for _ in range(num_sources):
+            mtime, size, source_hash, name_length = _source_header.unpack_from(buffer, offset)
+            offset += _source_header.size
+            name = bytes(buffer[offset:offset + name_length]).decode("utf-8")
+            offset += name_length
+
+            # Sources which have been touched without changing are still valid
+            if name not in _sources:
+                raise ValueError("Symbol index has an unknown source")
+            if stats[name] != (mtime, size) and _get_source_hash(_sources[name]) != source_hash:
+                raise ValueError("Symbol index is out of date")
+
+    except (ValueError, struct.error):
+        buffer.close()
+        return None
+
+    return buffer, offset
+
+
+def load():
+    return _load(config.get_path(config.config["Misc"]["symbol_index"]))
+
+
+@functools.lru_cache(maxsize=None)
+def _load(path):
+    if (opened := _open_index(path)) is None:
+        try:
+            tables = build(path)
+        except OSError as e:
+            # The index may be mapped by another process on platforms which do not allow replacing it
+            print(f"Could not write symbol index '{path}': {e}")
+            return SymbolIndex.from_tables(read_tables())
+
+        if (opened := _open_index(path)) is None:
+            return SymbolIndex.from_tables(tables)
+
+    return SymbolIndex.from_buffer(*opened)
+
+
+# ----- Main ----- #
+if __name__ == "__main__":
+    build(config.get_path(config.config["Misc"]["symbol_index"]))
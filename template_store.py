@@ -0,0 +1,129 @@
+import collections.abc
+import csv
+import json
+import os
+import threading
+
+
+class TemplateStore(collections.abc.MutableMapping):
+    # Templates are kept in a CSV file, with each change since it was last written appended to a journal beside it as a
+    # line of JSON. Changes are only written when they happen, and the CSV is rewritten from memory once no further
+    # changes have been made for 'compact_delay' seconds, or when the store is closed. Without a path, templates are
+    # only kept in memory
+    def __init__(self, path=None, compact_delay=5.0):
+        self.path = path
+        self.journal_path = None if path is None else path + ".journal"
+        self.compact_delay = compact_delay
+
+        self._templates = {}
+        self._lock = threading.RLock()
+        self._journal = None
+        self._journal_length = 0
+        self._timer = None
+
+        if path is not None:
+            self._load()
+
+    def _load(self):
+        if os.path.exists(self.path):
+            with open(self.path, newline="", encoding="utf-8") as file:
+                reader = csv.reader(file)
+                next(reader, None)
+
+                for name, template in reader:
+                    self._templates[name] = template
+
+        if not os.path.exists(self.journal_path):
+            return
+
+        # Only the last entry can be incomplete, if a write was interrupted. It is cut off, so that later entries are
+        # not appended onto it
+        good_length = 0
+        with open(self.journal_path, "rb") as file:
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break
+
+                try:
+                    operation, name, *template = json.loads(line)
+
+                    if operation == "s":
+                        self._templates[name] = template[0]
+                    else:
+                        self._templates.pop(name, None)
+                except (ValueError, TypeError, IndexError):
+                    break
+
+                good_length += len(line)
+                self._journal_length += 1
+
+        if good_length != os.path.getsize(self.journal_path):
+            with open(self.journal_path, "r+b") as file:
+                file.truncate(good_length)
+
+    def _append(self, entry):
+        if self.path is None:
+            return
+
+        if self._journal is None:
+            self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+        self._journal.write(json.dumps(entry) + "\n")
+        self._journal.flush()
+        self._journal_length += 1
+
+        if self._timer is not None:
+            self._timer.cancel()
+
+        self._timer = threading.Timer(self.compact_delay, self.compact)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def __getitem__(self, name):
+        return self._templates[name]
+
+    def __setitem__(self, name, template):
+        with self._lock:
+            self._templates[name] = template
+            self._append(("s", name, template))
+
+    def __delitem__(self, name):
+        with self._lock:
+            del self._templates[name]
+            self._append(("d", name))
+
+    def __iter__(self):
+        return iter(self._templates)
+
+    def __len__(self):
+        return len(self._templates)
+
+    def compact(self):
+        # Writes every template to a new CSV file which replaces the old one, then empties the journal. If interrupted
+        # before the journal is emptied, replaying it over the new file gives the same templates
+        with self._lock:
+            self._timer = None
+
+            if self.path is None or self._journal_length == 0:
+                return
+
+            with open(self.path + ".tmp", "w", newline="", encoding="utf-8") as file:
+                writer = csv.writer(file)
+                writer.writerow(("Name", "Template"))
+                writer.writerows(self._templates.items())
+
+            os.replace(self.path + ".tmp", self.path)
+
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            os.remove(self.journal_path)
+
+            self._journal_length = 0
+
+    def close(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+
+            self.compact()
@@ -0,0 +1,31 @@
+import unittest
+
+import controls
+
+
+class ScannerTest(unittest.TestCase):
+    def setUp(self):
+        self.scanner = controls.Scanner(".")
+
+    def get_history(self, text):
+        return [(before, entry_num) for line in self.scanner.scan(text) for _, _, before, entry_num in line.history]
+
+    def test_recall_within_word_is_text(self):
+        for text in ("file.h", "#include <stdio.h>", ".r include stdio.h, then $x^2$", "see file.h[2]"):
+            self.assertEqual(self.get_history(text), [], text)
+
+    def test_recall_starting_word(self):
+        self.assertEqual(self.get_history(".h"), [("", None)])
+        self.assertEqual(self.get_history("a .h[2] b"), [("", "2")])
+        self.assertEqual(self.get_history("x\n.h and\t.h[3]"), [("", None), ("", "3")])
+
+    def test_spans_around_recall(self):
+        self.assertEqual(self.scanner.scan("$x$ .h $y$")[0].spans, [(0, 3, "", "x"), (7, 10, "", "y")])
+
+    def test_escaped_recall_is_text(self):
+        self.assertEqual(self.get_history(r"a \.h"), [])
+        self.assertEqual(self.get_history(r"a \\.h"), [("\\\\", None)])
+
+
+if __name__ == "__main__":
+    unittest.main()
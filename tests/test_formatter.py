@@ -0,0 +1,79 @@
+import os
+import tempfile
+import unittest
+
+import config
+import context_manager
+import formatter
+import symbol_index
+
+
+class HistoryRecallTest(unittest.TestCase):
+    def setUp(self):
+        self.text_formatter = formatter.Formatter()
+        self.context = context_manager.get_font_context("MONOSPACED")
+
+    def tearDown(self):
+        self.text_formatter.close()
+
+    def reformat(self, text):
+        return self.text_formatter.reformat(text, self.context)
+
+    def test_file_name_without_history(self):
+        self.assertEqual(self.reformat(r".r see file.h and $x^2$"), " see file.h and x²")
+        self.assertEqual(self.reformat("stdio.h"), "stdio.h")
+
+    def test_file_name_with_history(self):
+        self.reformat(r"\frac{a}{b}")
+
+        self.assertEqual(self.reformat(r".r include stdio.h, then $x^2$"), " include stdio.h, then x²")
+        self.assertEqual(self.reformat(r".r see file.h and $x^2$"), " see file.h and x²")
+        self.assertEqual(self.reformat("stdio.h"), "stdio.h")
+
+    def test_recall_formats_rest_of_line(self):
+        self.reformat("x^2")
+        self.assertEqual(self.reformat(r".r last was .h and $y^2$"), " last was x² and y²")
+
+    def test_unresolved_recall_is_text(self):
+        self.assertEqual(self.reformat(r".r see .h and $x^2$"), " see .h and x²")
+
+
+class ExplicitPathTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.context = context_manager.get_font_context("MONOSPACED")
+
+    def tearDown(self):
+        config.load(os.environ.get("LHF_CONFIG", config.get_path("config.ini")))
+
+        # The index is mapped while loaded, which prevents removing it on Windows
+        symbol_index._load.cache_clear()
+        self.directory.cleanup()
+
+    def test_config_path(self):
+        with open(config.get_path("config.ini"), encoding="utf-8") as file:
+            contents = file.read().replace("latex_by_default = 1", "latex_by_default = 0")
+
+        path = os.path.join(self.directory.name, "config.ini")
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(contents)
+
+        text_formatter = formatter.Formatter(config_path=path)
+        try:
+            self.assertEqual(text_formatter.reformat(r"x^2 and $x^2$", self.context), "x^2 and x²")
+        finally:
+            text_formatter.close()
+
+    def test_symbol_index_path(self):
+        path = os.path.join(self.directory.name, "index.lhfs")
+
+        text_formatter = formatter.Formatter(symbol_index_path=path)
+        try:
+            self.assertEqual(text_formatter.reformat(r"\alpha^2", self.context), "α²")
+            self.assertTrue(os.path.exists(path))
+        finally:
+            text_formatter.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+
+import context_manager
+import latex_parser
+
+
+class EscapedBracketTest(unittest.TestCase):
+    # Escaped brackets are plain text, and never open or close a group
+    def setUp(self):
+        self.context = context_manager.get_font_context("MONOSPACED")
+
+    def parse(self, text):
+        return latex_parser.parse(text, self.context)
+
+    def test_escaped_bracket_in_function_group(self):
+        self.assertEqual(self.parse(r"\frac{\alpha}{\|}"), "α\n——\n|")
+        self.assertEqual(self.parse(r"\frac{\{}{x}"), "{\n——\nx")
+
+    def test_escaped_bracket_in_group(self):
+        self.assertEqual(self.parse(r"{\{}"), "{")
+        self.assertEqual(self.parse(r"(\{ \} =) - b"), "({ } =) - b")
+
+    def test_escaped_bracket_at_top_level(self):
+        self.assertEqual(self.parse(r"\{x\}"), "{ x }")
+
+    def test_empty_group_keeps_row(self):
+        self.assertEqual(self.parse("a()b"), "a()b")
+        self.assertEqual(self.parse(r"\left(\right)"), "()")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,190 @@
+import functools
+import logging
+import threading
+import time
+
+import config
+
+# Stages are listed in this order when dumped, followed by any others
+_stage_order = ("hotkey", "capture", "context", "parse", "tokenize.lex", "tokenize.parse", "get_component", "build",
+                "render", "paste")
+
+
+class Histogram:
+    # Durations in nanoseconds are counted in four buckets per power of two, so percentiles are within about 20%
+    __slots__ = ("count", "total", "minimum", "maximum", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.minimum = None
+        self.maximum = 0
+        self.buckets = {}
+
+    @staticmethod
+    def _get_bucket(duration):
+        if duration < 8:
+            return duration
+
+        # The three leading bits select one of four buckets within each power of two
+        shift = duration.bit_length() - 3
+        return (shift + 1 << 2) | (duration >> shift & 3)
+
+    @staticmethod
+    def _get_bucket_limit(bucket):
+        if bucket < 8:
+            return bucket
+
+        shift = (bucket >> 2) - 1
+        return ((bucket & 3 | 4) + 1 << shift) - 1
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        self.maximum = max(self.maximum, duration)
+        if self.minimum is None or duration < self.minimum:
+            self.minimum = duration
+
+        bucket = Histogram._get_bucket(duration)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def percentile(self, fraction):
+        target = fraction * self.count
+        seen = 0
+
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= target:
+                return min(self.maximum, Histogram._get_bucket_limit(bucket))
+
+        return self.maximum
+
+
+class Trace:
+    # Events recorded while formatting a single expression, in the order they finished. Events without a duration only
+    # carry data, such as the items placed on each rendered line. Data is kept as text, as tokens are consumed by later
+    # stages
+    def __init__(self):
+        self.events = []
+
+    def add(self, stage, duration, data):
+        self.events.append((stage, duration, "" if data is None else repr(data)))
+
+    def format(self):
+        lines = []
+        for stage, duration, data in self.events:
+            duration = "" if duration is None else f"{duration / 1e6:.3f} ms"
+            lines.append(f"{stage:<16}{duration:>12}  {data}")
+        return "\n".join(lines)
+
+
+def record(stage, duration, data=None):
+    if enabled:
+        with _lock:
+            if (histogram := _histograms.get(stage)) is None:
+                histogram = _histograms[stage] = Histogram()
+            histogram.add(duration)
+
+    if _trace is not None:
+        _trace.add(stage, duration, data)
+
+
+def note(stage, data):
+    if _trace is not None:
+        _trace.add(stage, None, data)
+
+
+def start():
+    # Returns 0 when nothing is being recorded, so stop() can return straight away
+    if enabled or _trace is not None:
+        return time.perf_counter_ns()
+    return 0
+
+
+def stop(stage, start_time, data=None):
+    if start_time:
+        record(stage, time.perf_counter_ns() - start_time, data)
+
+
+def timed(stage):
+    # Functions are left unwrapped unless timings or show_steps are turned on, so there is no cost when disabled
+    def decorator(func):
+        if not enabled and not _tracing:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start_time = start()
+            result = func(*args, **kwargs)
+            stop(stage, start_time)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def begin_trace():
+    # Only the outermost trace is kept, so that nested stages are reported together
+    global _trace
+
+    if _trace is not None:
+        return None
+
+    _trace = Trace()
+    return _trace
+
+
+def end_trace(trace):
+    global _trace
+
+    if trace is not None:
+        _trace = None
+        _logger.info(trace.format())
+
+
+def get_summary():
+    with _lock:
+        rows = sorted(_histograms.items(), key=lambda item: (
+            _stage_order.index(item[0]) if item[0] in _stage_order else len(_stage_order), item[0]))
+
+    if not rows:
+        return "No timings recorded" if enabled else "Timings are disabled"
+
+    lines = [f"{'Stage':<16}{'Count':>8}{'Mean':>11}{'p50':>11}{'p90':>11}{'p99':>11}{'Max':>11}  (ms)"]
+    for stage, histogram in rows:
+        values = (histogram.total / histogram.count, histogram.percentile(0.5), histogram.percentile(0.9),
+                  histogram.percentile(0.99), histogram.maximum)
+        lines.append(f"{stage:<16}{histogram.count:>8}" + "".join(f"{value / 1e6:>11.3f}" for value in values))
+
+    return "\n".join(lines)
+
+
+def dump(path=None):
+    # Appends the summary to the given file, or the one set in config.ini, or logs it if neither is set
+    summary = get_summary()
+    path = path or config.config["Timing"]["output"]
+
+    if path:
+        with open(path, "a", encoding="utf-8") as file:
+            file.write(time.strftime("%Y-%m-%d %H:%M:%S") + "\n" + summary + "\n\n")
+    else:
+        _logger.info(summary)
+
+    return summary
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+# ----- Main ----- #
+_logger = logging.getLogger(__name__)
+
+enabled = bool(int(config.config["Timing"]["enabled"]))
+_tracing = bool(int(config.config["Parser"]["show_steps"]))
+
+_histograms = {}
+_lock = threading.Lock()
+_trace = None